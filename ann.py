@@ -0,0 +1,132 @@
+import os
+import zipfile
+
+import numpy as np
+
+# Defaults favour recall; fewer tables or more bits per table trade recall for speed
+NUM_TABLES = 8
+NUM_BITS = 12
+NUM_PROBES = 2
+SEED = 0
+RECALL_SAMPLE = 200  # queries compared against exact scoring when an index is built
+
+
+class LSHIndex:
+    # Random-hyperplane LSH for cosine similarity: each table hashes a row to the signs of
+    # its projections onto num_bits random hyperplanes, so similar rows tend to share buckets
+    def __init__(self, planes, order, sorted_codes, num_probes=NUM_PROBES, version='', seed=SEED, recall=None):
+        self.planes = planes
+        self.order = order
+        self.sorted_codes = sorted_codes
+        self.num_probes = num_probes
+        self.version = version
+        self.seed = seed
+        self.recall = recall  # mean recall@10 against exact scoring, measured at build time
+
+    @classmethod
+    def build(cls, features, num_tables=NUM_TABLES, num_bits=NUM_BITS, num_probes=NUM_PROBES, seed=SEED, version=''):
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((num_tables, features.shape[1], num_bits)).astype(np.float32)
+        index = cls(planes, None, None, num_probes, version, seed)
+        codes = index.hash(features)
+        # Per table, rows sorted by bucket code so a bucket is a contiguous slice
+        index.order = np.argsort(codes, axis=0, kind='stable').T.astype(np.int32)
+        index.sorted_codes = np.take_along_axis(codes, index.order.T, axis=0).T
+        return index
+
+    @property
+    def num_tables(self):
+        return self.planes.shape[0]
+
+    @property
+    def num_bits(self):
+        return self.planes.shape[2]
+
+    @property
+    def params(self):
+        return lsh_params(self.num_tables, self.num_bits, self.num_probes, self.seed)
+
+    def hash(self, features, with_margins=False):
+        weights = np.left_shift(1, np.arange(self.num_bits, dtype=np.int64))
+        codes = np.empty((features.shape[0], self.num_tables), dtype=np.int64)
+        margins = np.empty((features.shape[0], self.num_tables, self.num_bits), dtype=np.float32) if with_margins else None
+        for table in range(self.num_tables):
+            projected = np.asarray(features @ self.planes[table])
+            codes[:, table] = (projected > 0) @ weights
+            if with_margins:
+                margins[:, table] = np.abs(projected)
+        return (codes, margins) if with_margins else codes
+
+    def candidates(self, query):
+        # Rows sharing a bucket with the query in any table, also probing the buckets
+        # reached by flipping the num_probes least certain bits
+        codes, margins = self.hash(query, with_margins=True)
+        found = []
+        for table in range(self.num_tables):
+            code = codes[0, table]
+            probes = [code] + [code ^ (1 << int(bit)) for bit in np.argsort(margins[0, table])[:self.num_probes]]
+            for probe in probes:
+                start, end = np.searchsorted(self.sorted_codes[table], [probe, probe + 1])
+                found.append(self.order[table, start:end])
+        return np.unique(np.concatenate(found))
+
+    def save(self, path):
+        # A temporary name per process, since several workers may save the same index at once
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, planes=self.planes, order=self.order, sorted_codes=self.sorted_codes,
+                 num_probes=self.num_probes, version=self.version, seed=self.seed,
+                 recall=np.nan if self.recall is None else self.recall)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, version='', **params):
+        # None when the file is missing or unreadable, or was built for another dataset
+        # version or with other parameters
+        try:
+            with np.load(path) as stored:
+                if str(stored['version']) != version:
+                    return None
+                recall = float(stored['recall'])
+                index = cls(stored['planes'], stored['order'], stored['sorted_codes'], int(stored['num_probes']),
+                            version, int(stored['seed']), None if np.isnan(recall) else recall)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+        if index.params != lsh_params(**params):
+            return None
+        return index
+
+
+def lsh_params(num_tables=NUM_TABLES, num_bits=NUM_BITS, num_probes=NUM_PROBES, seed=SEED):
+    # The full set of build parameters, with the defaults filled in
+    return {'num_tables': num_tables, 'num_bits': num_bits, 'num_probes': num_probes, 'seed': seed}
+
+
+def recall_at_k(engine, k=10, sample_size=RECALL_SAMPLE, seed=SEED):
+    # Mean fraction of the exact top-k that approximate mode also returns
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(engine.titles), size=min(sample_size, len(engine.titles)), replace=False)
+    recalls = []
+    for row in rows:
+        exact = set(engine.recommend_row(row, k, approximate=False)[0])
+        if exact:
+            approximate = set(engine.recommend_row(row, k, approximate=True)[0])
+            recalls.append(len(exact & approximate) / len(exact))
+    return float(np.mean(recalls)) if recalls else 1.0
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from catalog import load_catalog
+    from engine import Recommender
+
+    parser = argparse.ArgumentParser(description="Build the approximate recommendation index and measure its recall")
+    parser.add_argument('--csv', default='goodreads.csv')
+    parser.add_argument('--tables', type=int, default=NUM_TABLES)
+    parser.add_argument('--bits', type=int, default=NUM_BITS)
+    parser.add_argument('--probes', type=int, default=NUM_PROBES)
+    args = parser.parse_args()
+
+    index = Recommender(load_catalog(args.csv)).prepare_approximate(num_tables=args.tables, num_bits=args.bits,
+                                                                    num_probes=args.probes)
+    print(f"Index with {index.num_tables} tables of {index.num_bits} bits, recall@10 {index.recall:.0%}")
@@ -0,0 +1,204 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from catalog import Catalog  # noqa: E402
+from engine import ChartAggregates, ChartEngine, FilterEngine, Recommender, setup_chart_frame  # noqa: E402
+from stats import AttributeStats  # noqa: E402
+from streaming import stream_chart_summary  # noqa: E402
+from synthetic import SEED, catalog_path  # noqa: E402
+from text_features import DescriptionVectors, vectors_directory  # noqa: E402
+
+# Headless timings of the hot paths on synthetic catalogs, written as JSON. Compare two
+# runs with --baseline to list the benchmarks that got slower.
+
+SIZES = [10_000, 100_000, 1_000_000]
+WARMUP = 1
+REPEAT = 5
+TEXT_BENCHMARK_WEIGHT = 0.3
+REGRESSION_THRESHOLD = 1.2  # slower than this multiple of the baseline median is a regression
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+FILTER_QUERIES = [
+    {'title_search': 'love'},
+    {'min_rating': '4', 'max_pages': '300'},
+    {'genres': ['Fantasy', 'Romance']},
+    {'genres': ['Fantasy', 'Romance'], 'match_all': True, 'min_rating': '3.5'},
+]
+
+
+def measure(run, warmup=WARMUP, repeat=REPEAT, setup=None):
+    # Wall-clock times of repeat runs after warmup runs, then one more run under
+    # tracemalloc for the peak memory it allocates (tracing slows it, so it is not timed).
+    # tracemalloc sees Python and numpy allocations, not memory-mapped files.
+    def once():
+        argument = setup() if setup else None
+        gc.collect()
+        start = time.perf_counter()
+        run(argument) if setup else run()
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        once()
+    times = [once() for _ in range(repeat)]
+    argument = setup() if setup else None
+    gc.collect()
+    tracemalloc.start()
+    run(argument) if setup else run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'times': times, 'min': min(times), 'median': float(np.median(times)), 'mean': float(np.mean(times)),
+            'peak_memory_bytes': peak}
+
+
+def benchmark_size(rows, cache_root, warmup, repeat, selected):
+    path = catalog_path(rows)
+    cache_dir = os.path.join(cache_root, str(rows))
+    results = {}
+
+    def add(name, run, setup=None, **options):
+        if selected and name not in selected:
+            return
+        print(f"  {name}", file=sys.stderr, flush=True)
+        results[name] = measure(run, options.get('warmup', warmup), options.get('repeat', repeat), setup)
+
+    def clear_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # Parsing the CSV is the slowest path, so it gets fewer repetitions
+    add('load_csv', lambda _: Catalog(path, cache_dir), setup=clear_cache, warmup=0, repeat=max(1, repeat // 2))
+    catalog = Catalog(path, cache_dir)
+    add('load_cached', lambda: Catalog(path, cache_dir))
+
+    add('filter_engine_build', lambda: FilterEngine(catalog.view(), catalog.genres))
+    filter_engine = FilterEngine(catalog.view(), catalog.genres)
+    for i, query in enumerate(FILTER_QUERIES):
+        add(f'filter_books_{i}', lambda query=query: filter_engine.filter_books(**query))
+
+    add('recommender_build', lambda: Recommender(catalog))
+    recommender = Recommender(catalog)
+    recommender.table = None  # time the live scoring, not a precomputed table
+    titles = catalog.frame['title'].sample(20, random_state=SEED).tolist()
+    add('recommend_books_exact', lambda: [recommender.recommend_books(title, 10) for title in titles])
+    recommender.recommend_books(titles[0], 10, approximate=True)  # builds the LSH index outside the timing
+    add('recommend_books_approximate',
+        lambda: [recommender.recommend_books(title, 10, approximate=True) for title in titles])
+
+    # Description vectors: the one-off parallel build, reopening them and blended scoring
+    add('description_vectors_build', lambda: DescriptionVectors.build(
+        recommender.data, recommender.engine.titles, vectors_directory(catalog), catalog.version),
+        warmup=0, repeat=max(1, repeat // 2))
+    add('description_vectors_open', lambda: recommender.use_descriptions(catalog, TEXT_BENCHMARK_WEIGHT))
+    add('recommend_books_text', lambda: [recommender.recommend_books(title, 10) for title in titles])
+    recommender.engine.use_text(None)
+
+    chart_frame = setup_chart_frame(catalog.view())
+    add('chart_aggregates', lambda: ChartAggregates.from_frame(chart_frame))
+    chart_engine = ChartEngine.from_summary(ChartAggregates.from_frame(chart_frame))
+    add('chart_prepare_all', lambda: [chart_engine.preparers[chart]() for chart in ChartEngine.CHARTS])
+    add('chart_streaming', lambda: stream_chart_summary(path), warmup=0, repeat=max(1, repeat // 2))
+
+    add('attribute_stats', lambda: AttributeStats(catalog.frame))
+    stats = AttributeStats(catalog.frame)
+    add('attribute_stats_read', lambda: (stats.correlation(), [stats.describe(a) for a in stats.attributes]))
+
+    # A 1% delta: half replaced books, half new ones
+    delta = catalog.frame.sample(max(rows // 100, 2), random_state=SEED).reset_index(drop=True)
+    delta.loc[len(delta) // 2:, 'title'] = delta['title'][len(delta) // 2:].astype(str) + ' (New Edition)'
+
+    def fresh_catalog():
+        updated = Catalog(path, cache_dir)
+        FilterEngine.from_catalog(updated)
+        Recommender(updated)
+        ChartEngine.from_catalog(updated).get_summary()
+        return updated
+
+    add('catalog_update', lambda updated: updated.update(delta, save=False), setup=fresh_catalog,
+        warmup=0, repeat=max(1, repeat // 2))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    # (size, benchmark, ratio) for every benchmark slower than threshold x the baseline median
+    regressions = []
+    for size, benchmarks in results['results'].items():
+        for name, result in benchmarks.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if previous and previous['median'] > 0:
+                ratio = result['median'] / previous['median']
+                if ratio > threshold:
+                    regressions.append((size, name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time NextPage's hot paths on synthetic catalogs")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="catalog rows to benchmark")
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--only', nargs='+', help="benchmark names to run (default: all)")
+    parser.add_argument('-o', '--output', help="results JSON (default: benchmarks/results/<time>.json)")
+    parser.add_argument('--baseline', help="earlier results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': SEED,
+            'warmup': args.warmup,
+            'repeat': args.repeat,
+        },
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='nextpage_bench_') as cache_root:
+        for rows in args.sizes:
+            print(f"{rows:,} rows", file=sys.stderr, flush=True)
+            results['results'][str(rows)] = benchmark_size(rows, cache_root, args.warmup, args.repeat, args.only)
+
+    output = args.output or os.path.join(RESULTS_DIR, results['meta']['timestamp'].replace(':', '') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for size, name, ratio in regressions:
+            print(f"REGRESSION {name} at {int(size):,} rows: {ratio:.2f}x the baseline median")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Synthetic catalogs with the columns of goodreads.csv, for benchmarking at sizes the
+# real export does not reach. The same rows and seed always give the same file.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SEED = 0
+
+GENRES = [
+    'Fiction', 'Fantasy', 'Romance', 'Young Adult', 'Classics', 'Nonfiction', 'Mystery', 'Historical Fiction',
+    'Contemporary', 'Science Fiction', 'Thriller', 'Literature', 'Novels', 'Adult', 'Audiobook', 'Paranormal',
+    'Historical', 'History', 'Childrens', 'Adventure', 'Horror', 'Crime', 'Humor', 'Magic', 'Biography',
+    'Philosophy', 'Poetry', 'Memoir', 'Graphic Novels', 'Chick Lit', 'Self Help', 'Dystopia', 'Mythology',
+    'Psychology', 'Religion', 'Short Stories', 'Science', 'Sports', 'Travel', 'Cookbooks',
+]
+FORMATS = ['Paperback', 'Hardcover', 'Kindle Edition', 'Mass Market Paperback', 'ebook', 'Audiobook',
+           'Board Book', 'Audio CD', 'Library Binding', 'Unknown Binding']
+FORMAT_WEIGHTS = [0.48, 0.24, 0.15, 0.05, 0.03, 0.02, 0.01, 0.008, 0.007, 0.005]
+LANGUAGES = ['English', 'Spanish', 'French', 'German', 'Italian', 'Portuguese', 'Japanese', 'Arabic']
+LANGUAGE_WEIGHTS = [0.9, 0.025, 0.02, 0.02, 0.01, 0.01, 0.01, 0.005]
+WORDS = ('the of and a to in his her was that with for on as at by from an life world love story new '
+         'family war night house time heart dark city secret girl king queen lost last first shadow '
+         'light death game river moon fire blood sea stone garden summer winter road home truth').split()
+
+
+def zipf_choice(rng, size, count, exponent=1.1):
+    # Indices in [0, count) with a few very popular values and a long tail
+    weights = 1 / np.arange(1, count + 1) ** exponent
+    return rng.choice(count, size=size, p=weights / weights.sum())
+
+
+def random_phrases(rng, rows, low, high):
+    lengths = rng.integers(low, high + 1, size=rows)
+    words = np.array(WORDS, dtype=object)[zipf_choice(rng, lengths.sum(), len(WORDS), 0.8)]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [' '.join(words[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def generate_catalog(rows, seed=SEED):
+    rng = np.random.default_rng(seed)
+
+    # Titles are mostly unique, with about 1% repeated as other editions
+    titles = [f"{phrase.title()} {i}" for i, phrase in enumerate(random_phrases(rng, rows, 1, 4))]
+    repeats = rng.choice(rows, size=rows // 100, replace=False)
+    titles = np.array(titles, dtype=object)
+    titles[repeats] = titles[rng.choice(rows, size=len(repeats))]
+
+    # Every book gets 1-7 distinct genres, popular genres far more often
+    counts = np.clip(rng.poisson(4, size=rows), 1, 7)
+    candidates = zipf_choice(rng, rows * 12, len(GENRES)).reshape(rows, 12).tolist()
+    genre_lists = [str([GENRES[i] for i in list(dict.fromkeys(picks))[:count]])
+                   for picks, count in zip(candidates, counts.tolist())]
+
+    num_pages = np.clip(rng.lognormal(np.log(320), 0.45, size=rows), 24, 2500).astype(int).astype(object)
+    num_pages[rng.random(rows) < 0.03] = 'unknown'
+    num_ratings = np.floor(rng.lognormal(6.5, 2.2, size=rows)).astype(np.int64)
+    # Ratings cluster around 4 and narrow as a book collects more votes; unrated books show 0
+    spread = 0.25 + 0.6 / np.log2(num_ratings + 2)
+    rating_score = np.round(np.clip(rng.normal(3.95, spread), 1, 5), 2)
+    rating_score[num_ratings == 0] = 0
+    in_series = rng.random(rows) < 0.3
+    series_count = max(rows // 8, 1)
+    price = np.round(rng.lognormal(np.log(12), 0.6, size=rows), 2)
+    price[rng.random(rows) < 0.25] = np.nan
+    days = rng.integers(0, 124 * 365, size=rows)
+
+    return pd.DataFrame({
+        'title': titles,
+        'authors': [f"Author {i}" for i in zipf_choice(rng, rows, max(rows // 5, 1), 0.9)],
+        'series_title': np.where(in_series, [f"Series {i}" for i in rng.integers(0, series_count, size=rows)], None),
+        'series_release_number': np.where(in_series, rng.integers(1, 12, size=rows), np.nan),
+        'publisher': [f"Publisher {i}" for i in zipf_choice(rng, rows, max(rows // 50, 1))],
+        'language': rng.choice(LANGUAGES, size=rows, p=LANGUAGE_WEIGHTS),
+        'num_pages': num_pages,
+        'format': rng.choice(FORMATS, size=rows, p=FORMAT_WEIGHTS),
+        'genres': genre_lists,
+        'publication_date': (np.datetime64('1900-01-01') + days.astype('timedelta64[D]')).astype(str),
+        'rating_score': rating_score,
+        'num_ratings': num_ratings,
+        'num_reviews': (num_ratings * rng.uniform(0.02, 0.1, size=rows)).astype(np.int64),
+        'current_readers': (num_ratings * rng.uniform(0, 0.05, size=rows)).astype(np.int64),
+        'want_to_read': (num_ratings * rng.uniform(0.2, 3, size=rows)).astype(np.int64),
+        'price': price,
+        'description': random_phrases(rng, rows, 20, 80),
+    })
+
+
+def catalog_path(rows, seed=SEED):
+    # Generated once per size and seed, then reused
+    path = os.path.join(DATA_DIR, f"goodreads_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        generate_catalog(rows, seed).to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic Goodreads-shaped catalog CSV")
+    parser.add_argument('rows', type=int)
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('-o', '--output', help="CSV to write (default: benchmarks/data/)")
+    args = parser.parse_args()
+
+    if args.output:
+        generate_catalog(args.rows, args.seed).to_csv(args.output, index=False)
+        print(args.output)
+    else:
+        print(catalog_path(args.rows, args.seed))
@@ -1,34 +1,43 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MultiLabelBinarizer
+from engine import Recommender
+from profiling import stage, timed
+from scheduler import get_scheduler
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+DESCRIPTION_PREVIEW = 600  # characters of a description shown before "Show more"
+
+
+def detail_lines(details):
+    return [
+        f"Title: {details['title']}",
+        f"Author: {details['authors']}",
+        f"Series: {details['series_title']}, Release #{details['series_release_number']}",
+        f"Publisher: {details['publisher']}",
+        f"Language: {details['language']}",
+        f"Number of Pages: {details['num_pages']}",
+        f"Format: {details['format']}",
+        f"Genres: {', '.join(details['genres'])}",
+        f"Publication Date: {details['publication_date']}",
+        f"Rating: {details['rating_score']:.1f}/5",
+        f"Number of Ratings: {details['num_ratings']}",
+        f"Number of Reviews: {details['num_reviews']}",
+        f"Current Readers: {details['current_readers']}",
+        f"Want to Read: {details['want_to_read']}",
+        f"Price: {details['price']}",
+    ]
+
 
 class BookRecommendationPage(tk.Frame):
     def __init__(self, parent):
         tk.Frame.__init__(self, parent)
-        self.data = pd.read_csv('goodreads.csv')
-        self.process_data()
+        self.recommender = Recommender()
+        self.selected_title = None
         self.create_widgets()
         self.configure_layout()
 
-    def process_data(self):
-        self.data['genres'] = self.data['genres'].apply(
-            lambda x: [genre.strip().strip("'") for genre in x.strip("[]").split(",")])
-        self.data = self.data.explode('genres')
-
-        mlb = MultiLabelBinarizer()
-        self.data_genres = self.data.groupby('title')['genres'].agg(set).reset_index()
-        self.genre_matrix = mlb.fit_transform(self.data_genres['genres'])
-
-        self.data['rating_score'] = self.data['rating_score'] / 5.0
-        ratings = self.data.groupby('title')['rating_score'].mean().values
-        self.features = np.hstack([self.genre_matrix, ratings[:, None]])
-
     def create_widgets(self):
         self.paned_window = ttk.Panedwindow(self, orient=tk.HORIZONTAL)
         self.paned_window.pack(fill=tk.BOTH, expand=True)
@@ -64,6 +73,7 @@ class BookRecommendationPage(tk.Frame):
         self.canvas_details.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(side="right", fill="y")
         self.detail_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.create_detail_panel()
 
         # Search bar frame
         self.search_frame = ttk.Frame(self.left_panel)
@@ -79,35 +89,62 @@ class BookRecommendationPage(tk.Frame):
         self.search_button = ttk.Button(self.search_frame, text="Search", command=self.search_books)
         self.search_button.pack(side=tk.LEFT, padx=(2, 10))
 
+        # Approximate mode scores only LSH candidates, for very large catalogs
+        self.mode_combobox = ttk.Combobox(self.search_frame, values=["Exact", "Approximate"], state="readonly", width=12)
+        self.mode_combobox.pack(side=tk.LEFT, padx=(2, 10))
+        self.mode_combobox.set("Exact")
+
+    def create_detail_panel(self):
+        # The detail widgets are created once; selecting a book only changes their text
+        self.detail_labels = []
+        self.description_label = ttk.Label(self.scrollable_frame, wraplength=500, justify="left")
+        self.more_button = ttk.Button(self.scrollable_frame, text="Show more",
+                                      command=lambda: self.show_description(full=True))
+
+    def detail_label(self, row):
+        while len(self.detail_labels) <= row:
+            label = ttk.Label(self.scrollable_frame, wraplength=500, justify="left")
+            label.grid(row=len(self.detail_labels), column=0, sticky='w', padx=5, pady=1)
+            self.detail_labels.append(label)
+        return self.detail_labels[row]
+
+    def clear_details(self):
+        self.selected_title = None
+        for label in self.detail_labels:
+            label.grid_remove()
+        self.description_label.grid_remove()
+        self.more_button.grid_remove()
+
     def configure_layout(self):
         self.pack(fill=tk.BOTH, expand=True)
 
     def search_books(self):
         book_title = self.search_var.get()
+        approximate = self.mode_combobox.get() == "Approximate"
         if book_title:
-            recommendations, scores = self.recommend_books(book_title)
-            if recommendations:
-                self.plot_recommendations(recommendations, scores)
-                self.book_combobox['values'] = recommendations
-                self.book_combobox.set('')
-                for widget in self.scrollable_frame.winfo_children():
-                    widget.destroy()
-            else:
-                messagebox.showinfo("No Results", "No similar books found. Try another title.")
-
-    def recommend_books(self, book_title, num_recommendations=10):
-        try:
-            idx = self.data_genres[self.data_genres['title'].str.lower() == book_title.lower()].index[0]
-            sim_scores = cosine_similarity(self.features[idx:idx + 1], self.features)[0]
-            sim_indices = np.argsort(sim_scores)[::-1][1:num_recommendations + 1]
-            return self.data_genres['title'].iloc[sim_indices].tolist(), sim_scores[sim_indices]
-        except IndexError:
-            return [], []
-
-    def plot_recommendations(self, recommendations, scores):
+            get_scheduler(self).submit('recommendation', lambda: self.recommend_books(book_title, approximate=approximate),
+                                       self.show_recommendations)
+
+    def show_recommendations(self, result):
+        recommendations, scores, recall = result
+        if recommendations:
+            self.plot_recommendations(recommendations, scores, recall)
+            self.book_combobox['values'] = recommendations
+            self.book_combobox.set('')
+            self.clear_details()
+        else:
+            messagebox.showinfo("No Results", "No similar books found. Try another title.")
+
+    def recommend_books(self, book_title, num_recommendations=10, approximate=False):
+        return self.recommender.recommend_with_recall(book_title, num_recommendations, approximate)
+
+    @timed('recommend.render')
+    def plot_recommendations(self, recommendations, scores, recall=None):
         self.ax.clear()
         self.ax.scatter(range(len(scores)), scores, picker=False)
         self.ax.set_ylabel('Similarity Score')
+        if recall is not None:
+            self.ax.set_title(f'Approximate results (recall@10 vs exact: {recall:.0%})')
         self.ax.set_xticks(range(len(recommendations)))
         self.ax.set_xticklabels(recommendations, rotation=45, ha="right")
 
@@ -115,36 +152,43 @@ class BookRecommendationPage(tk.Frame):
         for i, (rec, score) in enumerate(zip(recommendations, scores)):
             self.ax.annotate(f'{score:.2f}', (i, score), textcoords="offset points", xytext=(0, 10), ha='center')
 
-        self.fig.tight_layout()
-        self.canvas.draw()
+        with stage('recommend.canvas_draw'):
+            self.fig.tight_layout()
+            self.canvas.draw()
 
     def display_book_info(self, event=None):
         book_title = self.book_combobox.get()
-        if book_title:
-            book_data = self.data[self.data['title'].str.lower() == book_title.lower()].iloc[0]
-            for widget in self.scrollable_frame.winfo_children():
-                widget.destroy()
-            labels = [
-                f"Title: {book_data['title']}",
-                f"Author: {book_data['authors']}",
-                f"Series: {book_data['series_title']}, Release #{book_data['series_release_number']}",
-                f"Publisher: {book_data['publisher']}",
-                f"Language: {book_data['language']}",
-                f"Number of Pages: {book_data['num_pages']}",
-                f"Format: {book_data['format']}",
-                f"Genres: {book_data['genres']}",
-                f"Publication Date: {book_data['publication_date']}",
-                f"Rating: {book_data['rating_score'] * 5:.1f}/5",
-                f"Number of Ratings: {book_data['num_ratings']}",
-                f"Number of Reviews: {book_data['num_reviews']}",
-                f"Current Readers: {book_data['current_readers']}",
-                f"Want to Read: {book_data['want_to_read']}",
-                f"Price: {book_data['price']}",
-                f"Description: {book_data['description']}"
-            ]
-            for label_text in labels:
-                if "nan" not in label_text:
-                    label = ttk.Label(self.scrollable_frame, text=label_text, wraplength=500, justify="left")
-                    label.pack(fill='x', padx=5, pady=1, anchor='w')
-                    label.pack(fill=tk.BOTH, expand=True)
-
+        details = self.recommender.book_details(book_title) if book_title else None
+        if details is None:
+            self.clear_details()
+            return
+        for row, text in enumerate(detail_lines(details)):
+            label = self.detail_label(row)
+            if "nan" in text:
+                label.grid_remove()
+            else:
+                label.config(text=text)
+                label.grid()
+        self.selected_title = book_title
+        # The description can be long, so it is read once the other details are shown
+        self.description_label.grid_remove()
+        self.more_button.grid_remove()
+        self.after_idle(self.show_description)
+
+    def show_description(self, full=False):
+        if self.selected_title is None:
+            return
+        description = self.recommender.book_description(self.selected_title)
+        if description is None or pd.isna(description):
+            return
+        description = str(description)
+        shortened = not full and len(description) > DESCRIPTION_PREVIEW
+        if shortened:
+            description = description[:DESCRIPTION_PREVIEW].rstrip() + "..."
+        row = len(self.detail_labels)
+        self.description_label.config(text=f"Description: {description}")
+        self.description_label.grid(row=row, column=0, sticky='w', padx=5, pady=1)
+        if shortened:
+            self.more_button.grid(row=row + 1, column=0, sticky='w', padx=5, pady=1)
+        else:
+            self.more_button.grid_remove()
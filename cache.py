@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, max_size, on_evict=None):
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        # Entries are read and filled from worker threads as well as the Tk thread
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            evicted = []
+            while len(self.entries) > self.max_size:
+                evicted.append(self.entries.popitem(last=False))
+        self.evict(evicted)
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, predicate=None):
+        # Drops every entry, or only those whose key matches predicate
+        with self.lock:
+            keys = [key for key in self.entries if predicate is None or predicate(key)]
+            evicted = [(key, self.entries.pop(key)) for key in keys]
+        self.evict(evicted)
+
+    def evict(self, evicted):
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class TTLCache(LRUCache):
+    # LRUCache whose entries also expire ttl seconds after they were stored
+    def __init__(self, max_size, ttl, on_evict=None, clock=time.monotonic):
+        super().__init__(max_size, on_evict)
+        self.ttl = ttl
+        self.clock = clock
+        self.expiry = {}
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+            if self.expiry[key] > self.clock():
+                self.entries.move_to_end(key)
+                return value
+            del self.entries[key]
+            del self.expiry[key]
+        self.evict([(key, value)])
+        return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.expiry[key] = self.clock() + self.ttl
+            evicted = []
+            while len(self.entries) > self.max_size:
+                evicted.append(self.entries.popitem(last=False))
+            for old_key, old_value in evicted:
+                del self.expiry[old_key]
+        super().evict(evicted)
+
+    def evict(self, evicted):
+        # Entries dropped by invalidate() also lose their expiry times
+        with self.lock:
+            for key, value in evicted:
+                if key not in self.entries:
+                    self.expiry.pop(key, None)
+        super().evict(evicted)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries and self.expiry[key] > self.clock()
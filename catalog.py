@@ -0,0 +1,485 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from profiling import stage
+
+# Every page gets a shallow copy of the shared frame. Copy-on-write makes their
+# in-place cleaning copy the touched column instead of writing back into the
+# catalog (or into the read-only memory-mapped cache arrays).
+pd.set_option('mode.copy_on_write', True)
+
+CSV_PATH = 'goodreads.csv'
+CACHE_DIR_NAME = '.nextpage_cache'
+CACHE_FORMAT = 2
+CATEGORY_MAX_RATIO = 0.5  # dictionary-encode string columns with fewer distinct values than this share of rows
+
+
+class Catalog:
+    def __init__(self, path=CSV_PATH, cache_dir=None):
+        self.path = path
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+        self.base_version = self.source_version()
+        self.version = self.base_version
+        self.genres = None
+        self.subscribers = []
+        self.title_rows = None
+        self.duplicate_rows = None
+        self.delta_count = 0
+        with stage('catalog.load_cache'):
+            self.frame = self.load_cache()
+        if self.frame is None:
+            with stage('catalog.read_csv'):
+                self.frame = compact_frame(pd.read_csv(self.path))
+                self.genres = GenreLists.parse(self.frame['genres'])
+            with stage('catalog.write_cache'):
+                self.write_cache()
+        self.replay_deltas()
+
+    def source_version(self):
+        # The cache is valid only for the exact CSV it was built from
+        stat = os.stat(self.path)
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    def view(self):
+        return self.frame.copy(deep=False)
+
+    def meta_path(self):
+        return os.path.join(self.cache_dir, 'meta.json')
+
+    def load_cache(self):
+        try:
+            with open(self.meta_path()) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('format') != CACHE_FORMAT or meta.get('version') != self.base_version:
+            return None
+
+        columns = {}
+        try:
+            for i, column in enumerate(meta['columns']):
+                name = column['name']
+                if column['kind'] == 'numeric':
+                    # Numeric columns stay on disk and are paged in on demand
+                    columns[name] = np.asarray(np.load(self.column_path(i, 'npy'), mmap_mode='r'))
+                    continue
+                codes = np.asarray(np.load(self.column_path(i, 'codes.npy'), mmap_mode='r'))
+                with open(self.column_path(i, 'categories.json')) as f:
+                    categories = json.load(f)
+                if column['kind'] == 'category':
+                    columns[name] = pd.Categorical.from_codes(codes, categories)
+                else:
+                    # The extra trailing slot is what code -1 (missing) points at
+                    values = np.empty(len(categories) + 1, dtype=object)
+                    values[:-1] = categories
+                    values[-1] = np.nan
+                    columns[name] = values[codes]
+            with open(self.genres_path('vocabulary.json')) as f:
+                vocabulary = json.load(f)
+            self.genres = GenreLists(*(np.asarray(np.load(self.genres_path(f'{part}.npy'), mmap_mode='r'))
+                                       for part in ('indptr', 'indices')), vocabulary)
+        except (OSError, ValueError, KeyError):
+            return None
+        return pd.DataFrame(columns, copy=False)
+
+    def write_cache(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if os.path.exists(self.meta_path()):
+                os.remove(self.meta_path())
+
+            columns = []
+            for i, name in enumerate(self.frame.columns):
+                series = self.frame[name]
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    save_array(self.cache_dir, f'column{i}.codes', series.cat.codes.to_numpy())
+                    with open(self.column_path(i, 'categories.json'), 'w') as f:
+                        json.dump(series.cat.categories.tolist(), f)
+                    columns.append({'name': name, 'kind': 'category'})
+                elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+                    save_array(self.cache_dir, f'column{i}', series.to_numpy())
+                    columns.append({'name': name, 'kind': 'numeric'})
+                else:
+                    codes, categories = pd.factorize(series.astype(str).where(series.notna()), use_na_sentinel=True)
+                    save_array(self.cache_dir, f'column{i}.codes', codes.astype(np.int32))
+                    with open(self.column_path(i, 'categories.json'), 'w') as f:
+                        json.dump(categories.tolist(), f)
+                    columns.append({'name': name, 'kind': 'string'})
+            # Arrays go through save_array: other processes may still have the old ones mapped
+            save_array(self.cache_dir, 'genres.indptr', self.genres.indptr)
+            save_array(self.cache_dir, 'genres.indices', self.genres.indices)
+            with open(self.genres_path('vocabulary.json'), 'w') as f:
+                json.dump(self.genres.vocabulary, f)
+
+            # meta.json is written last so a half-written cache is never picked up
+            tmp_path = self.meta_path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'format': CACHE_FORMAT, 'version': self.base_version, 'columns': columns}, f)
+            os.replace(tmp_path, self.meta_path())
+        except OSError as e:
+            print("Could not write catalog cache:", e)
+
+    def column_path(self, index, suffix):
+        return os.path.join(self.cache_dir, f"column{index}.{suffix}")
+
+    def genres_path(self, suffix):
+        return os.path.join(self.cache_dir, f"genres.{suffix}")
+
+    def subscribe(self, callback):
+        # callback(delta) runs after every update, on the thread that called update
+        self.subscribers.append(callback)
+
+    def index_titles(self):
+        # Title -> first row, plus the later rows of repeated titles; built on first use
+        if self.title_rows is None:
+            titles = self.frame['title']
+            first = ~titles.duplicated(keep='first').to_numpy()
+            self.title_rows = dict(zip(titles[first], np.flatnonzero(first)))
+            self.duplicate_rows = {}
+            for title, row in zip(titles[~first], np.flatnonzero(~first)):
+                self.duplicate_rows.setdefault(title, []).append(row)
+
+    def row_for_title(self, title):
+        # First row of a title, or None
+        self.index_titles()
+        return self.title_rows.get(title)
+
+    def rows_for_titles(self, titles):
+        self.index_titles()
+        rows = []
+        for title in titles:
+            if title in self.title_rows:
+                rows.append(self.title_rows[title])
+                rows.extend(self.duplicate_rows.get(title, []))
+        return np.asarray(rows, dtype=np.int64)
+
+    def update(self, rows, save=True):
+        # Adds new books and replaces the first row of any title already in the catalog.
+        # Subscribers then update their own indexes from the returned CatalogDelta.
+        with stage('catalog.update'):
+            delta = self.apply_rows(rows, save)
+        for callback in self.subscribers:
+            callback(delta)
+        return delta
+
+    def apply_rows(self, rows, save):
+        rows = pd.DataFrame(rows).reindex(columns=self.frame.columns)
+        rows = rows[rows['title'].notna()].drop_duplicates(subset='title', keep='last').reset_index(drop=True)
+        if save:
+            self.save_delta(rows)
+        self.index_titles()
+        size = len(self.frame)
+        positions = np.array([self.title_rows.get(title, -1) for title in rows['title']], dtype=np.int64)
+        replaced = positions >= 0
+        old_frame = self.frame.iloc[positions[replaced]].reset_index(drop=True)
+        old_genres = self.genres.take(positions[replaced])
+
+        # New rows go on the end; a replaced row's new values are moved into its old position
+        new_positions = positions.copy()
+        new_positions[~replaced] = size + np.arange((~replaced).sum())
+        order = np.arange(size + (~replaced).sum())
+        order[new_positions] = size + np.arange(len(rows))
+        genres = GenreLists.parse(rows['genres'], self.genres.vocabulary)
+        self.frame = append_rows(self.frame, rows).take(order).reset_index(drop=True)
+        self.genres = self.genres.concat(genres).take(order)
+        for title, row in zip(rows['title'][~replaced], new_positions[~replaced]):
+            self.title_rows[title] = row
+
+        self.delta_count += 1
+        self.version = f"{self.base_version}+{self.delta_count}"
+        return CatalogDelta(self, new_positions, replaced, old_frame, old_genres)
+
+    def read_rows(self, path):
+        # Text columns are read as text so they line up with the catalog's categories
+        text_columns = [name for name in self.frame.columns if not pd.api.types.is_numeric_dtype(self.frame[name])]
+        return pd.read_csv(path, dtype={name: str for name in text_columns})
+
+    def delta_dir(self):
+        # Deltas belong to the CSV they were applied on top of
+        return os.path.join(self.cache_dir, 'deltas', self.base_version)
+
+    def save_delta(self, rows):
+        try:
+            os.makedirs(self.delta_dir(), exist_ok=True)
+            path = os.path.join(self.delta_dir(), f"{self.delta_count + 1:06d}.csv")
+            rows.to_csv(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            print("Could not save catalog update:", e)
+
+    def replay_deltas(self):
+        # Updates applied since the CSV was last changed, oldest first
+        try:
+            names = sorted(name for name in os.listdir(self.delta_dir()) if name.endswith('.csv'))
+        except OSError:
+            return
+        for name in names:
+            self.update(self.read_rows(os.path.join(self.delta_dir(), name)), save=False)
+
+    def memory_report(self):
+        # Bytes per column as held here against what a plain read_csv frame would hold
+        rows = []
+        for name in self.frame.columns:
+            series = self.frame[name]
+            compact = series.memory_usage(index=False, deep=True)
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                original = series.astype(object).memory_usage(index=False, deep=True)
+            elif pd.api.types.is_numeric_dtype(series):
+                original = len(series) * 8
+            else:
+                original = compact
+            rows.append((name, str(series.dtype), original, compact))
+        # Parsed genres used to be a Python list of strings per book
+        list_bytes = sum(sys.getsizeof([None] * length) for length in np.diff(self.genres.indptr))
+        rows.append(('genres (parsed)', 'csr', list_bytes, self.genres.nbytes))
+        report = pd.DataFrame(rows, columns=['column', 'dtype', 'read_csv_bytes', 'compact_bytes']).set_index('column')
+        report.loc['total'] = ['', report['read_csv_bytes'].sum(), report['compact_bytes'].sum()]
+        return report
+
+
+class CatalogDelta:
+    # What one Catalog.update changed: rows are the positions of the new or replaced
+    # books in the updated frame, replaced marks those that overwrote an existing book,
+    # whose previous values are kept in old_frame and old_genres
+    def __init__(self, catalog, rows, replaced, old_frame, old_genres):
+        self.catalog = catalog
+        self.version = catalog.version
+        self.rows = rows
+        self.replaced = replaced
+        self.old_frame = old_frame
+        self.old_genres = old_genres
+
+    @property
+    def frame(self):
+        return self.catalog.frame.iloc[self.rows].reset_index(drop=True)
+
+    @property
+    def genres(self):
+        return self.catalog.genres.take(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class GenreLists:
+    # Every book's genres as integer codes in CSR layout: the genres of row r are
+    # vocabulary[indices[indptr[r]:indptr[r + 1]]]. The vocabulary is sorted when parsed;
+    # genres first seen in an update are appended so existing codes never change.
+    def __init__(self, indptr, indices, vocabulary):
+        self.indptr = indptr
+        self.indices = indices
+        self.vocabulary = list(vocabulary)
+
+    @classmethod
+    def parse(cls, values, vocabulary=None):
+        # Books share a handful of genre strings, so each distinct string is parsed once
+        codes, uniques = pd.factorize(pd.Series(values).to_numpy(dtype=object))
+        parsed = [parse_genres(value) for value in uniques]
+        found = sorted({genre for genres in parsed for genre in genres})
+        if vocabulary is None:
+            vocabulary = found
+        else:
+            known = set(vocabulary)
+            vocabulary = list(vocabulary) + [genre for genre in found if genre not in known]
+        positions = {genre: i for i, genre in enumerate(vocabulary)}
+        unique_lists = cls.from_code_lists([[positions[genre] for genre in genres] for genres in parsed], vocabulary)
+        # Missing values (code -1) take the empty list appended at the end
+        unique_lists.indptr = np.append(unique_lists.indptr, unique_lists.indptr[-1])
+        return unique_lists.take(np.where(codes < 0, len(uniques), codes))
+
+    @classmethod
+    def from_code_lists(cls, code_lists, vocabulary):
+        lengths = np.fromiter((len(codes) for codes in code_lists), dtype=np.int64, count=len(code_lists))
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        indices = np.fromiter((code for codes in code_lists for code in codes), dtype=np.int32, count=indptr[-1])
+        return cls(indptr, indices, vocabulary)
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = np.diff(self.indptr)[rows]
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        # Position of every kept code in the old indices array
+        offsets = np.repeat(self.indptr[rows] - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return GenreLists(indptr, self.indices[offsets], self.vocabulary)
+
+    def concat(self, other):
+        # other's vocabulary must extend this one's
+        indptr = np.concatenate([self.indptr, other.indptr[1:] + self.indptr[-1]])
+        return GenreLists(indptr, np.concatenate([self.indices, other.indices]), other.vocabulary)
+
+    def row_ids(self):
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def lists(self):
+        names = np.array(self.vocabulary, dtype=object)[self.indices].tolist()
+        return [names[start:end] for start, end in zip(self.indptr[:-1].tolist(), self.indptr[1:].tolist())]
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + sum(sys.getsizeof(genre) for genre in self.vocabulary)
+
+    def __getitem__(self, row):
+        return [self.vocabulary[code] for code in self.indices[self.indptr[row]:self.indptr[row + 1]]]
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+
+class StringArray:
+    # Strings packed into one UTF-8 buffer, each followed by a NUL byte, with the start
+    # offset of every string. Unlike an object array, the two arrays can be saved and
+    # memory-mapped, so several processes can share one copy.
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [str(string).encode() + b'\0' for string in strings]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def take(self, rows):
+        values = np.empty(len(rows), dtype=object)
+        values[:] = [self[row] for row in rows]
+        return values
+
+    def concat(self, other):
+        return StringArray(np.concatenate([self.data, other.data]),
+                           np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]]))
+
+    def contains(self, text):
+        # Sorted rows whose string contains text. The NUL separators stop a match from
+        # running from one string into the next.
+        pattern = np.frombuffer(text.encode(), dtype=np.uint8)
+        if len(pattern) == 0 or 0 in pattern or len(pattern) > len(self.data):
+            return np.empty(0, dtype=np.int64)
+        end = len(self.data) - len(pattern) + 1
+        found = self.data[:end] == pattern[0]
+        for i in range(1, len(pattern)):
+            found &= self.data[i:end + i] == pattern[i]
+        return np.unique(np.searchsorted(self.offsets, np.flatnonzero(found), side='right') - 1)
+
+    def save(self, directory, name):
+        save_array(directory, f'{name}.data', self.data)
+        save_array(directory, f'{name}.offsets', self.offsets)
+
+    @classmethod
+    def open(cls, directory, name):
+        return cls(open_array(directory, f'{name}.data'), open_array(directory, f'{name}.offsets'))
+
+    def __getitem__(self, row):
+        return self.data[self.offsets[row]:self.offsets[row + 1] - 1].tobytes().decode()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def save_array(directory, name, array):
+    # Written beside the old file and swapped in, since readers may still map it
+    tmp_path = tmp_array_path(directory, name)
+    np.save(tmp_path, np.asarray(array))
+    replace_array(directory, name, tmp_path)
+
+
+def tmp_array_path(directory, name):
+    # Per process, so two processes writing the same array never share a temporary file
+    return os.path.join(directory, f'{name}.{os.getpid()}.tmp.npy')
+
+
+def replace_array(directory, name, tmp_path):
+    os.replace(tmp_path, os.path.join(directory, f'{name}.npy'))
+
+
+def open_array(directory, name):
+    # Memory-mapped, so every process opening the file shares its pages
+    path = os.path.join(directory, f'{name}.npy')
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)  # empty arrays cannot be mapped
+
+
+def append_rows(frame, rows):
+    # Appends rows to a compact frame; categoricals gain any new categories and
+    # numeric columns widen only as far as the new values need
+    columns = {}
+    for name in frame.columns:
+        series = frame[name]
+        new = rows[name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            new = new.astype(object).where(new.isna(), new.astype(str))
+            missing = pd.Index(new.dropna().unique()).difference(series.cat.categories, sort=False)
+            categories = series.cat.categories.append(missing)
+            codes = pd.Categorical(new, categories=categories).codes
+            columns[name] = pd.Categorical.from_codes(np.concatenate([series.cat.codes.to_numpy(), codes]), categories)
+        elif pd.api.types.is_numeric_dtype(series):
+            values = pd.to_numeric(new, errors='coerce').to_numpy()
+            with np.errstate(invalid='ignore', over='ignore'):
+                narrow = values.astype(series.dtype)
+            # Only the new values are checked; numpy widens the column if they do not fit
+            if np.array_equal(narrow.astype(values.dtype), values, equal_nan=values.dtype.kind == 'f'):
+                values = narrow
+            columns[name] = np.concatenate([series.to_numpy(), values])
+        else:
+            columns[name] = pd.concat([series, new.astype(object)], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def compact_frame(frame):
+    # Narrowest lossless dtype per column, and categoricals for repetitive strings
+    columns = {}
+    for name in frame.columns:
+        series = frame[name]
+        if pd.api.types.is_bool_dtype(series):
+            pass
+        elif pd.api.types.is_integer_dtype(series):
+            series = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            narrow = series.astype(np.float32)
+            if np.array_equal(narrow.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+                series = narrow
+        elif pd.api.types.is_object_dtype(series) and series.nunique() < CATEGORY_MAX_RATIO * len(series):
+            series = series.astype('category')
+        columns[name] = series
+    return pd.DataFrame(columns)
+
+
+def parse_genres(value):
+    # "['Fantasy', 'Fiction']" -> ['Fantasy', 'Fiction']
+    if not isinstance(value, str):
+        return []
+    return [genre.strip().strip("'\"") for genre in value.strip("[]").split(",") if genre.strip()]
+
+
+_catalogs = {}
+
+
+def load_catalog(path=CSV_PATH):
+    # One parsed catalog per CSV, shared by every page
+    key = os.path.abspath(path)
+    if key not in _catalogs:
+        _catalogs[key] = Catalog(path)
+    return _catalogs[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply a catalog update and show how much memory the catalog takes per column")
+    parser.add_argument('--csv', default=CSV_PATH)
+    parser.add_argument('--update', metavar='DELTA_CSV', help="add or replace the books in this CSV first")
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.csv)
+    if args.update:
+        delta = catalog.update(catalog.read_rows(args.update))
+        print(f"Added {(~delta.replaced).sum():,} and replaced {delta.replaced.sum():,} books")
+    report = catalog.memory_report()
+    print(report.to_string())
+    saved = report.loc['total', 'read_csv_bytes'] / max(report.loc['total', 'compact_bytes'], 1)
+    print(f"{saved:.1f}x smaller than the plain frame")
@@ -0,0 +1,155 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+from catalog import load_catalog
+from engine import ChartEngine, FilterEngine, Recommender, save_shared_engines
+
+# Query file: one JSON object per line, for example
+#   {"type": "recommend", "title": "Dune", "count": 10, "approximate": false}
+#   {"type": "filter", "title_search": "war", "min_rating": 4, "max_pages": 500,
+#    "genres": ["History"], "match_all": false, "limit": 50}
+#   {"type": "chart", "chart": "Top 10 Rated Books"}
+# A line that is not JSON is taken as a title to recommend for.
+
+CSV_COLUMNS = ['line', 'type', 'rank', 'title', 'score', 'error']
+FILTER_LIMIT = 100
+
+_engines = {}
+_shared_dir = None
+_charts = None
+_text_weight = 0.0
+
+
+def prepare_workers(csv_path, text_weight=0.0):
+    # Run once in the parent: the engines are stored for the workers to memory-map, and
+    # the chart summary, which is small, is handed to each worker directly
+    catalog = load_catalog(csv_path)
+    shared_dir = save_shared_engines(catalog, text_weight)
+    charts = ChartEngine(catalog.view(), catalog.version)
+    return shared_dir, charts.get_summary(), catalog.version, text_weight
+
+
+def init_worker(shared_dir, chart_summary, version, text_weight=0.0):
+    global _shared_dir, _charts, _text_weight
+    _shared_dir = shared_dir
+    _charts = (chart_summary, version)
+    _text_weight = text_weight
+
+
+def get_engine(kind):
+    # Engines are opened on first use in each worker, over the arrays prepare_workers stored
+    if kind not in _engines:
+        if kind == 'filter':
+            _engines[kind] = FilterEngine.open(os.path.join(_shared_dir, 'filter'))
+        elif kind == 'recommend':
+            _engines[kind] = Recommender.from_shared(os.path.join(_shared_dir, 'recommend'), _text_weight)
+        else:
+            _engines[kind] = ChartEngine.from_summary(*_charts)
+    return _engines[kind]
+
+
+def parse_query(line):
+    line = line.strip()
+    if not line.startswith('{'):
+        return {'type': 'recommend', 'title': line}
+    return json.loads(line)
+
+
+def run_query(numbered_line):
+    number, line = numbered_line
+    try:
+        query = parse_query(line)
+        kind = query.get('type', 'recommend')
+        if kind == 'recommend':
+            titles, scores = get_engine(kind).recommend_books(query['title'], int(query.get('count', 10)),
+                                                              bool(query.get('approximate', False)))
+            results = [{'title': title, 'score': float(score)} for title, score in zip(titles, scores)]
+        elif kind == 'filter':
+            filtered = get_engine(kind).filter_books(
+                title_search=query.get('title_search', ''),
+                min_rating=query.get('min_rating', "All"),
+                max_pages=query.get('max_pages', "All"),
+                genres=query.get('genres', ()),
+                match_all=bool(query.get('match_all', False)))
+            filtered = filtered.head(int(query.get('limit', FILTER_LIMIT)))
+            results = [{'title': row.title, 'score': float(row.rating_score), 'num_pages': int(row.num_pages),
+                        'genres': list(row.genres)} for row in filtered.itertuples()]
+        elif kind == 'chart':
+            results = chart_records(query['chart'], get_engine(kind).prepare(query['chart']))
+        else:
+            raise ValueError(f"unknown query type {kind!r}")
+        return {'line': number, 'query': query, 'results': results}
+    except Exception as e:
+        # One bad query becomes an error record instead of ending the batch
+        return {'line': number, 'query': line.strip(), 'error': f"{type(e).__name__}: {e}"}
+
+
+def chart_records(chart, data):
+    if chart == "Distribution of Book Length":
+        counts, edges = np.histogram(data['Num Pages'], bins=30, weights=data['Books'])
+        return [{'title': f"{low:.0f}-{high:.0f}", 'score': int(round(count))}
+                for low, high, count in zip(edges[:-1], edges[1:], counts)]
+    if chart == "Top Books by Voters and Rating":
+        data = data.set_index('Book')['Scaled Voters']
+    elif chart == "Top 10 Rated Books":
+        data = data.set_index('Book')['Rating']
+    return [{'title': str(label), 'score': float(value)} for label, value in data.items()]
+
+
+def write_results(results, output, output_format):
+    if output_format == 'csv':
+        writer = csv.DictWriter(output, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+    for result in results:
+        if output_format == 'csv':
+            if 'error' in result:
+                # One row per failed line, so it cannot pass for a query without matches
+                writer.writerow({'line': result['line'], 'type': 'error', 'error': result['error']})
+                continue
+            kind = result['query'].get('type', 'recommend')
+            for rank, record in enumerate(result['results'], start=1):
+                writer.writerow({'line': result['line'], 'type': kind, 'rank': rank,
+                                 'title': record['title'], 'score': record['score']})
+        else:
+            output.write(json.dumps(result) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run NextPage filter, recommendation and chart queries in batch")
+    parser.add_argument('queries', help="query file, one query per line ('-' for stdin)")
+    parser.add_argument('-o', '--output', default='-', help="output file ('-' for stdout)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    parser.add_argument('--csv', default='goodreads.csv', help="catalog CSV")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--text-weight', type=float, default=0.0,
+                        help="share of each recommendation score taken from description similarity")
+    args = parser.parse_args(argv)
+
+    queries = sys.stdin if args.queries == '-' else open(args.queries)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    # Build the engines once up front so the workers only have to map them
+    worker_args = prepare_workers(args.csv, args.text_weight)
+    numbered = ((number, line) for number, line in enumerate(queries, start=1) if line.strip())
+    try:
+        if args.workers and args.workers > 1:
+            with Pool(args.workers, initializer=init_worker, initargs=worker_args) as pool:
+                # imap keeps input order while streaming, so memory stays bounded
+                write_results(pool.imap(run_query, numbered, chunksize=16), output, args.format)
+        else:
+            init_worker(*worker_args)
+            write_results(map(run_query, numbered), output, args.format)
+    finally:
+        if queries is not sys.stdin:
+            queries.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,39 @@
 import tkinter as tk
 from tkinter import ttk
+import numpy as np
 import pandas as pd
+from catalog import load_catalog
+from profiling import stage, timed
+from scheduler import get_scheduler
+from stats import AttributeStats, density_grid, linear_fit
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.colors import LogNorm
 import seaborn as sns
 
+# Above this many rows the scatter plot switches to a density raster with a closed-form fit
+LARGE_DATA_THRESHOLD = 20000
+
 class DataVisualizationPage(tk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
-        self.data = pd.read_csv('goodreads.csv')
+        catalog = load_catalog()
+        self.data = catalog.view()
+        # Summaries of every numeric attribute, computed once; the stats panel and heat maps only read them
+        with stage('visualization.stats'):
+            self.stats = AttributeStats(self.data)
+        catalog.subscribe(self.on_catalog_update)
         self.selected_attribute1 = tk.StringVar()
         self.selected_attribute2 = tk.StringVar()
         self.selected_graph_type = tk.StringVar()
         self.create_widgets()
         self.initialize_graph()
 
+    def on_catalog_update(self, delta):
+        self.data = delta.catalog.view()
+        self.stats.remove(delta.old_frame)
+        self.stats.append(delta.frame)
+
     def create_widgets(self):
         # Set up comboboxes and labels in a single row for better layout
         ttk.Label(self, text="First Attribute:").grid(row=0, column=0, padx=10, pady=5)
@@ -33,7 +52,7 @@ class DataVisualizationPage(tk.Frame):
 
         ttk.Label(self, text="Graph Type:").grid(row=0, column=4, padx=10, pady=5)
         self.graph_type_combobox = ttk.Combobox(self, textvariable=self.selected_graph_type,
-                                                values=["Scatter Plot", "Heat Map"],
+                                                values=["Scatter Plot", "Heat Map", "Heat Map (All Attributes)"],
                                                 state="readonly")
         self.graph_type_combobox.grid(row=0, column=5, padx=10, pady=5)
         self.graph_type_combobox.bind("<<ComboboxSelected>>", self.update_graph)
@@ -54,43 +73,82 @@ class DataVisualizationPage(tk.Frame):
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
     def update_graph(self, event=None):
+        # Selections are read here on the Tk thread, the data work runs on a worker
+        attribute1 = self.selected_attribute1.get()
+        attribute2 = self.selected_attribute2.get()
+        graph_type = self.selected_graph_type.get()
+        get_scheduler(self).submit('data_visualization',
+                                   lambda: self.prepare_graph(graph_type, attribute1, attribute2),
+                                   lambda prepared: self.render_graph(graph_type, attribute1, attribute2, *prepared))
+
+    @timed('visualization.prepare')
+    def prepare_graph(self, graph_type, attribute1, attribute2):
+        if graph_type == "Heat Map":
+            graph_data = self.stats.correlation([attribute1, attribute2])
+        elif graph_type == "Heat Map (All Attributes)":
+            graph_data = self.stats.correlation()
+        else:
+            graph_data = self.prepare_scatter_data(attribute1, attribute2)
+        stats1 = self.stats.describe(attribute1).apply(lambda x: f"{x:,.4f}")
+        stats2 = self.stats.describe(attribute2).apply(lambda x: f"{x:,.4f}")
+        return graph_data, stats1, stats2
+
+    def prepare_scatter_data(self, attribute1, attribute2):
+        x = pd.to_numeric(self.data[attribute1], errors='coerce').to_numpy(dtype=float)
+        y = pd.to_numeric(self.data[attribute2], errors='coerce').to_numpy(dtype=float)
+        if len(self.data) <= LARGE_DATA_THRESHOLD:
+            # Categorical or downcast columns are plotted as plain floats
+            return pd.DataFrame({attribute1: x, attribute2: y})
+        return {'density': density_grid(x, y), 'fit': linear_fit(x, y)}
+
+    def render_graph(self, graph_type, attribute1, attribute2, graph_data, stats1, stats2):
         # Clear the axes and any existing content completely, including legends
         self.ax.clear()
         if self.ax.get_legend():
             self.ax.get_legend().remove()
-        graph_type = self.selected_graph_type.get()
 
-        if graph_type == "Scatter Plot":
-            self.draw_scatter_plot()
-        elif graph_type == "Heat Map":
-            self.draw_heat_map()
-
-        self.canvas.draw_idle()  # Efficiently redraw the canvas with the new graph
-        self.update_statistics()
-
-    def draw_scatter_plot(self):
-        x = self.selected_attribute1.get()
-        y = self.selected_attribute2.get()
-        sns.regplot(x=x, y=y, data=self.data, ax=self.ax,
+        with stage('visualization.draw'):
+            if graph_type == "Scatter Plot":
+                self.draw_scatter_plot(graph_data, attribute1, attribute2)
+            elif graph_type in ("Heat Map", "Heat Map (All Attributes)"):
+                self.draw_heat_map(graph_data)
+
+        with stage('visualization.canvas_draw'):
+            self.canvas.draw()
+        self.update_statistics(attribute1, attribute2, stats1, stats2)
+
+    def draw_scatter_plot(self, data, x, y):
+        if not isinstance(data, pd.DataFrame):
+            self.draw_density_plot(data, x, y)
+            return
+        sns.regplot(x=x, y=y, data=data, ax=self.ax,
                     scatter_kws={'s': 50, 'alpha': 0.5}, line_kws={'color': 'red'})
         self.ax.set_title(f'Scatter Plot of {x} vs {y}')
 
-    def draw_heat_map(self):
-        corr = self.data[[self.selected_attribute1.get(), self.selected_attribute2.get()]].corr()
+    def draw_density_plot(self, data, x, y):
+        if data['density'] is not None:
+            counts, x_edges, y_edges, total = data['density']
+            # Empty bins are masked so they show as background
+            self.ax.imshow(np.ma.masked_equal(counts.T, 0), origin='lower', aspect='auto',
+                           extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]),
+                           norm=LogNorm(), cmap='Blues', interpolation='nearest')
+        if data['fit'] is not None:
+            grid, fitted, lower, upper = data['fit']
+            self.ax.plot(grid, fitted, color='red')
+            self.ax.fill_between(grid, lower, upper, color='red', alpha=0.15)
+        self.ax.set_xlabel(x)
+        self.ax.set_ylabel(y)
+        total = data['density'][3] if data['density'] is not None else 0
+        self.ax.set_title(f'Density of {x} vs {y} ({total:,} books)')
+
+    def draw_heat_map(self, corr):
         sns.heatmap(corr, annot=True, fmt=".4f", ax=self.ax, cmap='coolwarm')
         self.ax.set_title('Heat Map Showing Correlation')
 
-    def update_statistics(self):
+    def update_statistics(self, attribute1, attribute2, stats1, stats2):
         # Clear previous statistics
         for widget in self.stats_frame.winfo_children():
             widget.destroy()
 
-        attribute1 = self.selected_attribute1.get()
-        attribute2 = self.selected_attribute2.get()
-
-        # Compute and display statistics
-        stats1 = self.data[attribute1].describe().apply(lambda x: f"{x:,.4f}")
-        stats2 = self.data[attribute2].describe().apply(lambda x: f"{x:,.4f}")
-
         ttk.Label(self.stats_frame, text=f"Statistics: {attribute1} \n{stats1}", justify=tk.LEFT).pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         ttk.Label(self.stats_frame, text=f"Statistics: {attribute2} \n{stats2}", justify=tk.LEFT).pack(side=tk.TOP, fill=tk.BOTH, expand=True)
@@ -0,0 +1,492 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+from catalog import GenreLists, StringArray, append_rows, load_catalog, open_array, save_array
+from indexes import GenreIndex, TrigramIndex
+from profiling import stage, timed
+from recommendation_table import RecommendationTable, row_hashes, table_directory
+from recommender import TEXT_WEIGHT, RecommendationEngine, title_aggregates
+
+# Tk-free data processing shared by the GUI pages, cli.py and any other batch job
+
+AGGREGATE_CACHE_SIZE = 16
+PAGE_BIN_WIDTH = 10  # pages per bin of the book length histogram
+SHARED_DIR_NAME = 'shared_engines'
+SHARED_FORMAT = 1  # bump when the stored arrays change
+TOP_BOOKS = 20
+TOP_RATED = 10
+TOP_AUTHORS = 20
+TOP_COLUMNS = ['Book', 'authors', 'Number of voters', 'Rating']
+DETAIL_COLUMNS = ['title', 'authors', 'series_title', 'series_release_number', 'publisher', 'language', 'num_pages',
+                  'format', 'publication_date', 'rating_score', 'num_ratings', 'num_reviews', 'current_readers',
+                  'want_to_read', 'price']
+
+
+def clean_filter_frame(data, genres=None):
+    # genres is the GenreLists aligned with data's rows; parsed from the column if not given
+    if genres is None:
+        genres = GenreLists.parse(data['genres'])
+    num_pages = pd.to_numeric(data['num_pages'], errors='coerce')
+    # Drop rows where 'num_pages' conversion failed, then repeated titles
+    keep = num_pages.notna().to_numpy().copy()
+    keep[keep] = ~data['title'][keep].duplicated(keep='first').to_numpy()
+    rows = np.flatnonzero(keep)
+    data = data.iloc[rows].drop(columns='genres').reset_index(drop=True)
+    data['num_pages'] = num_pages.to_numpy()[rows].astype(int)
+    return data, genres.take(rows)
+
+
+def setup_chart_frame(df):
+    # Convert and prepare data as needed for plotting
+    df['Number of voters'] = pd.to_numeric(df['num_ratings'], errors='coerce')
+    df['Rating'] = pd.to_numeric(df['rating_score'], errors='coerce')
+    df['Num Pages'] = pd.to_numeric(df['num_pages'], errors='coerce')
+    df['Book'] = df['title']  # Ensure this column is set up correctly
+    return df
+
+
+class FilterEngine:
+    def __init__(self, data, genres=None):
+        self.data = data
+        self.genres = genres
+        self.clean_data()
+
+    @classmethod
+    def from_catalog(cls, catalog=None):
+        catalog = catalog or load_catalog()
+        engine = cls(catalog.view(), catalog.genres)
+        catalog.subscribe(engine.apply_delta)
+        return engine
+
+    @timed('filter.clean')
+    def clean_data(self):
+        self.data, self.genres = clean_filter_frame(self.data, self.genres)
+        self.titles = self.data['title']
+        self.title_index = TrigramIndex(self.data['title'])
+        self.genre_index = GenreIndex(self.genres)
+        # Rows of replaced books stay in place but never match again
+        self.removed = np.zeros(len(self.data), dtype=bool)
+        self.title_rows = None
+
+    @timed('filter.apply_delta')
+    def apply_delta(self, delta):
+        # Replaced books are tombstoned and, like new ones, appended with their new values
+        if self.title_rows is None:
+            self.title_rows = dict(zip(self.data['title'], range(len(self.data))))
+        delta_frame = delta.frame
+        stale = [self.title_rows[title] for title in delta_frame['title'] if title in self.title_rows]
+        self.removed[stale] = True
+        data, genres = clean_filter_frame(delta_frame, delta.genres)
+        start = len(self.data)
+        self.data = append_rows(self.data, data)
+        self.titles = self.data['title']
+        self.genres = self.genres.concat(genres)
+        self.title_index.add(data['title'])
+        self.genre_index.add(genres)
+        self.removed = np.concatenate([self.removed, np.zeros(len(data), dtype=bool)])
+        self.title_rows.update(zip(data['title'], range(start, len(self.data))))
+
+    @timed('filter.query')
+    def filter_books(self, title_search='', min_rating="All", max_pages="All", genres=(), match_all=False):
+        # Every criterion is a boolean mask over the books, combined with &
+        # A min_rating or max_pages that is not a number raises ValueError
+        mask = ~self.removed
+        if title_search:
+            title_mask = np.zeros(len(self.data), dtype=bool)
+            title_mask[self.title_index.search(title_search.lower())] = True
+            mask &= title_mask
+        ratings = self.data['rating_score'].to_numpy()
+        num_pages = self.data['num_pages'].to_numpy()
+        if min_rating != "All":
+            mask &= ratings >= float(min_rating)
+        if max_pages != "All":
+            mask &= num_pages <= int(max_pages)
+        if genres:
+            mask &= self.genre_index.mask(genres, match_all=match_all)
+        rows = np.flatnonzero(mask)
+        rows = rows[np.argsort(-ratings[rows], kind='stable')]
+        # Titles and genre names are only materialised for the matching books
+        return pd.DataFrame({'title': np.asarray(self.titles.take(rows), dtype=object),
+                             'rating_score': ratings[rows], 'num_pages': num_pages[rows],
+                             'genres': self.genres.take(rows).lists()}, index=rows)
+
+    def save(self, directory):
+        # The arrays a query needs, for open() to memory-map in other processes
+        os.makedirs(directory, exist_ok=True)
+        StringArray.from_strings(self.titles).save(directory, 'display_titles')
+        save_array(directory, 'rating_score', self.data['rating_score'].to_numpy())
+        save_array(directory, 'num_pages', self.data['num_pages'].to_numpy())
+        save_array(directory, 'genres.indptr', self.genres.indptr)
+        save_array(directory, 'genres.indices', self.genres.indices)
+        with open(os.path.join(directory, 'genres.vocabulary.json'), 'w') as f:
+            json.dump(self.genres.vocabulary, f)
+        self.title_index.save(directory)
+        self.genre_index.save(directory)
+
+    @classmethod
+    def open(cls, directory):
+        # Query-only engine over the mapped arrays; it cannot take catalog updates
+        engine = cls.__new__(cls)
+        engine.data = pd.DataFrame({'rating_score': open_array(directory, 'rating_score'),
+                                    'num_pages': open_array(directory, 'num_pages')}, copy=False)
+        engine.titles = StringArray.open(directory, 'display_titles')
+        with open(os.path.join(directory, 'genres.vocabulary.json')) as f:
+            vocabulary = json.load(f)
+        engine.genres = GenreLists(open_array(directory, 'genres.indptr'), open_array(directory, 'genres.indices'),
+                                   vocabulary)
+        engine.title_index = TrigramIndex.open(directory)
+        engine.genre_index = GenreIndex.open(directory)
+        engine.removed = np.zeros(len(engine.titles), dtype=bool)
+        engine.title_rows = None
+        return engine
+
+
+class Recommender:
+    @timed('recommend.build')
+    def __init__(self, catalog=None, text_weight=TEXT_WEIGHT, index_params=None):
+        catalog = catalog or load_catalog()
+        self.catalog = catalog
+        # num_tables, num_bits, num_probes and seed of the approximate index (see ann.py)
+        self.index_params = dict(index_params or {})
+        self.data_version = catalog.version
+        self.data = catalog.view()
+        self.genres = catalog.genres
+        self.engine = RecommendationEngine.from_frame(self.data, self.genres)
+        # Built now so looking up a book's details never has to scan the catalog
+        catalog.index_titles()
+        self.ann_index_path = os.path.join(catalog.cache_dir, 'ann_index.npz')
+        # Precomputed neighbours from recommendation_table.py, if it has been run
+        self.table = RecommendationTable.open(table_directory(catalog))
+        if self.table is not None and self.table.version != catalog.version:
+            self.table = None
+        self.descriptions = None
+        if text_weight:
+            self.use_descriptions(catalog, text_weight)
+        catalog.subscribe(self.apply_delta)
+
+    def save(self, directory):
+        self.engine.save(directory)
+        # The approximate index, the recommendation table and the description vectors
+        # already live in the catalog cache, so only where to find them is stored
+        meta = {'version': self.data_version, 'cache_dir': self.catalog.cache_dir,
+                'ann_index_path': self.ann_index_path, 'table_directory': table_directory(self.catalog)}
+        with open(os.path.join(directory, 'recommender.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def from_shared(cls, directory, text_weight=TEXT_WEIGHT, index_params=None):
+        # Query-only recommender over a directory written by save(): the features are
+        # memory-mapped, the catalog is never loaded and book details are not available
+        with open(os.path.join(directory, 'recommender.json')) as f:
+            meta = json.load(f)
+        recommender = cls.__new__(cls)
+        recommender.catalog = recommender.data = recommender.genres = None
+        recommender.index_params = dict(index_params or {})
+        recommender.data_version = meta['version']
+        recommender.engine = RecommendationEngine.open(directory)
+        recommender.ann_index_path = meta['ann_index_path']
+        recommender.table = RecommendationTable.open(meta['table_directory'])
+        if recommender.table is not None and recommender.table.version != meta['version']:
+            recommender.table = None
+        recommender.descriptions = None
+        if text_weight:
+            from text_features import VECTORS_DIR_NAME, DescriptionVectors
+            recommender.descriptions = DescriptionVectors.open(os.path.join(meta['cache_dir'], VECTORS_DIR_NAME),
+                                                               meta['version'], len(recommender.engine.titles))
+            if recommender.descriptions is not None:
+                recommender.engine.use_text(recommender.descriptions.vectors, text_weight)
+        return recommender
+
+    def use_descriptions(self, catalog, weight=TEXT_WEIGHT, workers=None):
+        # Description vectors are memory-mapped from the cache when they match this
+        # catalog version, and computed once in worker processes otherwise
+        # Imported here so sklearn is only loaded once descriptions are used
+        from text_features import DescriptionVectors, vectors_directory
+        with stage('recommend.description_vectors'):
+            directory = vectors_directory(catalog)
+            descriptions = DescriptionVectors.open(directory, catalog.version, len(self.engine.titles))
+            if descriptions is None:
+                descriptions = DescriptionVectors.build(self.data, self.engine.titles, directory, catalog.version,
+                                                        workers=workers)
+        self.descriptions = descriptions
+        self.engine.use_text(descriptions.vectors, weight)
+
+    @timed('recommend.apply_delta')
+    def apply_delta(self, delta):
+        # Only the titles in the delta are re-aggregated, over all of their rows
+        catalog = delta.catalog
+        rows = catalog.rows_for_titles(delta.frame['title'].unique())
+        titles, genres, ratings = title_aggregates(catalog.frame.iloc[rows], catalog.genres.take(rows))
+        text_vectors = None
+        if self.descriptions is not None:
+            text_vectors = self.descriptions.transform(catalog.frame.iloc[rows], titles)
+        self.engine.update(titles, genres, ratings, text_vectors)
+        self.data = catalog.view()
+        self.genres = catalog.genres
+        self.data_version = delta.version
+        # The stored neighbours cannot include the new books
+        self.table = None
+
+    def recommend_books(self, book_title, num_recommendations=10, approximate=False):
+        return self.recommend_with_recall(book_title, num_recommendations, approximate)[:2]
+
+    @timed('recommend.query')
+    def recommend_with_recall(self, book_title, num_recommendations=10, approximate=False):
+        # Titles, scores and the recall@10 of the approximate index used (None for exact
+        # results), so callers on another thread never read the engine's current mode
+        self.engine.use_approximate(approximate, index_path=self.ann_index_path, version=self.data_version,
+                                    **self.index_params)
+        recall = self.engine.ann_recall if approximate else None
+        row = self.engine.lookup(book_title)
+        if row is None:
+            return [], [], recall
+        # The stored neighbours were ranked without description similarity
+        if not approximate and self.table is not None and not self.engine.text_weight:
+            stored = self.table.lookup(book_title, num_recommendations, row_hashes(self.engine.features[row])[0])
+            if stored is not None:
+                return (*stored, None)
+        return (*self.engine.recommend_row(row, num_recommendations, approximate), recall)
+
+    def prepare_approximate(self, **index_params):
+        # Loads or builds (and saves) the approximate index up front, so the first
+        # approximate query does not pay for the build and its recall measurement
+        self.index_params.update(index_params)
+        self.engine.use_approximate(True, index_path=self.ann_index_path, version=self.data_version,
+                                    **self.index_params)
+        self.engine.approximate = False
+        return self.engine.ann_index
+
+    def book_row(self, book_title):
+        # Catalog row of a title, matched the way recommendations match titles
+        row = self.engine.lookup(book_title)
+        if row is None:
+            return None
+        return self.catalog.row_for_title(self.engine.titles[row])
+
+    def book_details(self, book_title):
+        # Everything the detail panel shows except the description, or None for an unknown title
+        row = self.book_row(book_title)
+        if row is None:
+            return None
+        details = {column: self.data[column].iat[row] for column in DETAIL_COLUMNS if column in self.data}
+        details['genres'] = self.genres[row]
+        return details
+
+    def book_description(self, book_title):
+        row = self.book_row(book_title)
+        if row is None or 'description' not in self.data:
+            return None
+        return self.data['description'].iat[row]
+
+
+def save_shared_engines(catalog, text_weight=TEXT_WEIGHT):
+    # Writes the filter and recommendation engines under the catalog cache for worker
+    # processes to open with FilterEngine.open and Recommender.from_shared, so they all
+    # map one copy of the arrays. Reused until the catalog version changes.
+    directory = os.path.join(catalog.cache_dir, SHARED_DIR_NAME)
+    meta_path = os.path.join(directory, 'meta.json')
+    meta = {'format': SHARED_FORMAT, 'version': catalog.version}
+    recommender = None
+    if text_weight:
+        # Builds the description vectors if they are missing, so workers only map them
+        recommender = Recommender(catalog, text_weight)
+    try:
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return directory
+    except (OSError, ValueError):
+        pass
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    FilterEngine(catalog.view(), catalog.genres).save(os.path.join(directory, 'filter'))
+    (recommender or Recommender(catalog)).save(os.path.join(directory, 'recommend'))
+    # meta.json last, so a partly written store is never opened
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return directory
+
+
+def observed_counts(series):
+    # value_counts without the unused categories of a categorical column
+    counts = series.value_counts()
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(object)
+    return counts
+
+
+class ChartAggregates:
+    # Everything the Interesting Data charts need, as partial results that can be merged,
+    # so a catalog can be summarised chunk by chunk (see streaming.py)
+    def __init__(self, format_counts, author_sums, author_counts, page_bins, top_voted, top_rated):
+        self.format_counts = format_counts
+        self.author_sums = author_sums
+        self.author_counts = author_counts
+        self.page_bins = page_bins  # books per PAGE_BIN_WIDTH-page bin, keyed by bin number
+        self.top_voted = top_voted
+        self.top_rated = top_rated
+
+    @classmethod
+    def from_frame(cls, df):
+        # df must already have been through setup_chart_frame
+        ratings = df.groupby('authors', observed=True)['Rating']
+        author_sums, author_counts = ratings.sum(), ratings.count()
+        author_sums.index = author_counts.index = author_sums.index.astype(object)
+        page_bins = (df['Num Pages'].dropna() // PAGE_BIN_WIDTH).astype(np.int64).value_counts()
+        top_voted = df.sort_values(by=['Number of voters', 'Rating'], ascending=False).head(TOP_BOOKS)
+        return cls(observed_counts(df['format']), author_sums, author_counts, page_bins,
+                   top_voted[TOP_COLUMNS], df.nlargest(TOP_RATED, 'Rating')[TOP_COLUMNS])
+
+    def remove(self, other):
+        # Takes rows back out of the counts and sums; the top lists cannot be reduced,
+        # so callers recompute when a removed row is on one of them
+        def subtract(a, b):
+            # Entries that drop to zero go, as if they had never been counted
+            result = a.sub(b, fill_value=0).astype(a.dtype)
+            return result[result != 0]
+
+        counts = subtract(self.author_counts, other.author_counts)
+        return ChartAggregates(subtract(self.format_counts, other.format_counts),
+                               self.author_sums.sub(other.author_sums, fill_value=0).reindex(counts.index),
+                               counts, subtract(self.page_bins, other.page_bins), self.top_voted, self.top_rated)
+
+    def on_top_lists(self, books):
+        return bool(np.isin(books, pd.concat([self.top_voted['Book'], self.top_rated['Book']])).any())
+
+    def merge(self, other):
+        def add(a, b):
+            return a.add(b, fill_value=0).astype(np.result_type(a.dtype, b.dtype))
+
+        top_voted = pd.concat([self.top_voted, other.top_voted], ignore_index=True)
+        top_voted = top_voted.sort_values(by=['Number of voters', 'Rating'], ascending=False).head(TOP_BOOKS)
+        top_rated = pd.concat([self.top_rated, other.top_rated], ignore_index=True).nlargest(TOP_RATED, 'Rating')
+        return ChartAggregates(add(self.format_counts, other.format_counts),
+                               add(self.author_sums, other.author_sums),
+                               add(self.author_counts, other.author_counts),
+                               add(self.page_bins, other.page_bins), top_voted, top_rated)
+
+    def book_format_data(self):
+        # Calculate the total counts and percentages
+        format_counts = self.format_counts.sort_values(ascending=False, kind='stable')
+        total = format_counts.sum()
+        percentages = (format_counts / total) * 100
+
+        # Identify small categories and sum them into 'Others'
+        small_categories = percentages < 3
+        others_sum = format_counts[small_categories].sum()
+
+        # Drop small categories and add 'Others'
+        format_counts = format_counts[~small_categories]
+        if others_sum > 0:
+            format_counts['Others'] = others_sum
+
+        return format_counts
+
+    def top_books(self):
+        # Scale the 'Number of voters' by dividing by 10,000 for better visualization scale
+        return self.top_voted.assign(**{'Scaled Voters': self.top_voted['Number of voters'] / 10000})
+
+    def book_length_data(self):
+        # Bin centres with their book counts, drawn as a weighted histogram
+        bins = self.page_bins.sort_index()
+        return pd.DataFrame({'Num Pages': (bins.index.to_numpy() + 0.5) * PAGE_BIN_WIDTH,
+                             'Books': bins.to_numpy()})
+
+    def top10_rated_books(self):
+        return self.top_rated
+
+    def top20_authors_by_average_rating(self):
+        return (self.author_sums / self.author_counts).nlargest(TOP_AUTHORS)
+
+
+class ChartEngine:
+    CHARTS = [
+        "Top Books by Voters and Rating",
+        "Distribution of Book Length",
+        "Distribution of Book Formats",
+        "Top 10 Rated Books",
+        "Average ratings of the books of the Top 20 authors",
+    ]
+
+    def __init__(self, df=None, version='', summary=None):
+        self.df = df
+        self.version = version
+        self.summary = summary
+        if df is not None:
+            self.setup_dataframe()
+        # Aggregates are keyed by chart and dataset version, so new data never hits stale entries
+        self.aggregates = LRUCache(AGGREGATE_CACHE_SIZE)
+        self.preparers = dict(zip(self.CHARTS, [
+            self.prepare_top_books,
+            self.prepare_book_length_data,
+            self.prepare_book_format_data,
+            self.prepare_top10_rated_books,
+            self.prepare_top20_authors_by_average_rating,
+        ]))
+
+    @classmethod
+    def from_catalog(cls, catalog=None):
+        catalog = catalog or load_catalog()
+        engine = cls(catalog.view(), catalog.version)
+        catalog.subscribe(engine.apply_delta)
+        return engine
+
+    @timed('charts.apply_delta')
+    def apply_delta(self, delta):
+        summary = self.get_summary()
+        old_frame = setup_chart_frame(delta.old_frame)
+        if len(old_frame) and summary.on_top_lists(old_frame['Book'].to_numpy(dtype=object)):
+            # A replaced book was on a top list, whose runner-up is unknown: recount everything
+            self.set_data(delta.catalog.view(), delta.version)
+            return
+        if len(old_frame):
+            summary = summary.remove(ChartAggregates.from_frame(old_frame))
+        self.summary = summary.merge(ChartAggregates.from_frame(setup_chart_frame(delta.frame)))
+        self.df = None  # the summary is current, the old rows are not
+        self.version = delta.version
+        self.aggregates.invalidate(lambda key: key[1] != delta.version)
+
+    @classmethod
+    def from_summary(cls, summary, version=''):
+        # Charts from merged aggregates alone, without the rows they were computed from
+        return cls(version=version, summary=summary)
+
+    @timed('charts.aggregate')
+    def get_summary(self):
+        if self.summary is None:
+            self.summary = ChartAggregates.from_frame(self.df)
+        return self.summary
+
+    @timed('charts.prepare')
+    def prepare(self, chart):
+        # The result is shared between callers and must be treated as read-only
+        return self.aggregates.get_or_compute((chart, self.version), self.preparers[chart])
+
+    def set_data(self, df, version):
+        self.df = df
+        self.version = version
+        self.summary = None
+        self.setup_dataframe()
+        self.aggregates.invalidate(lambda key: key[1] != version)
+
+    def setup_dataframe(self):
+        setup_chart_frame(self.df)
+
+    def prepare_book_format_data(self):
+        return self.get_summary().book_format_data()
+
+    def prepare_top_books(self):
+        return self.get_summary().top_books()
+
+    def prepare_book_length_data(self):
+        return self.get_summary().book_length_data()
+
+    def prepare_top10_rated_books(self):
+        return self.get_summary().top10_rated_books()
+
+    def prepare_top20_authors_by_average_rating(self):
+        return self.get_summary().top20_authors_by_average_rating()
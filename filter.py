@@ -1,75 +1,131 @@
 import tkinter as tk
+import tkinter.font as tkfont
 from tkinter import ttk
 import pandas as pd
+from engine import FilterEngine
+from profiling import timed
+from scheduler import DEBOUNCE_MS, get_scheduler
+
+RESULT_BUFFER = 10  # rows formatted beyond the visible ones, so a resize never shows a gap
+WHEEL_ROWS = 3  # rows moved per mouse wheel step
+RESULT_COLUMNS = ['title', 'rating_score', 'num_pages', 'genres']
 
 class FilterBooksPage(tk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
-        self.data = pd.read_csv('goodreads.csv')
-        self.clean_data()
+        self.engine = FilterEngine.from_catalog()
+        self.data = self.engine.data
         self.create_widgets()
 
-    def clean_data(self):
-        self.data['num_pages'] = pd.to_numeric(self.data['num_pages'], errors='coerce')
-        self.data.dropna(subset=['num_pages'], inplace=True)  # Remove rows where 'num_pages' conversion failed
-        self.data['num_pages'] = self.data['num_pages'].astype(int)
-        self.data['genres'] = self.data['genres'].apply(lambda x: [genre.strip() for genre in x.strip("[]").split(",")])
-        self.data = self.data.explode('genres')
-        self.data.drop_duplicates(subset='title', keep='first', inplace=True)
-
-    def filter_books(self):
-        title_search = self.title_entry.get().lower()
-        min_rating = self.rating_combobox.get()
-        max_pages = self.pages_combobox.get()
-        genre = self.genre_combobox.get()
-
-        filtered = self.data
+    def read_filters(self):
+        # Widgets are read on the Tk thread; filter_books itself runs on a worker
+        return {
+            'title_search': self.title_entry.get().lower(),
+            'min_rating': self.rating_combobox.get(),
+            'max_pages': self.pages_combobox.get(),
+            'genres': [self.genre_listbox.get(i) for i in self.genre_listbox.curselection()],
+            'match_all': self.genre_match_combobox.get() == "All",
+        }
+
+    def filter_books(self, **filters):
         try:
-            if title_search:
-                filtered = filtered[filtered['title'].str.lower().str.contains(title_search)]
-            if min_rating != "All":
-                filtered = filtered[filtered['rating_score'] >= float(min_rating)]
-            if max_pages != "All":
-                filtered = filtered[filtered['num_pages'] <= int(max_pages)]
-            if genre and genre != "All":
-                filtered = filtered[filtered['genres'].str.contains(genre, case=False, na=False)]
-            filtered = filtered.sort_values(by='rating_score', ascending=False)
+            return self.engine.filter_books(**filters)
         except ValueError as e:
             print("Error:", e)
-            return pd.DataFrame(columns=self.data.columns)  # Return an empty DataFrame on error
-        return filtered[['title', 'rating_score', 'num_pages', 'genres']]
-
-    def update_display(self):
-        filtered_data = self.filter_books()
-        self.result_listbox.delete(0, tk.END)  # Clear previous results
-        # Header
-        self.result_listbox.insert(tk.END, f"{'Title':<80}{'Rating':<10}{'Pages':<10}{'Genres'}")
-        # Data rows
-        for index, row in filtered_data.iterrows():
-            title = row['title'] if len(row['title']) < 30 else row['title'][:60]
-            genres = row['genres'] if len(row['genres']) < 20 else row['genres'][:25]
-            list_entry = f"{title:<80}{row['rating_score']:<10}{row['num_pages']:<10}{genres}"
-            self.result_listbox.insert(tk.END, list_entry)
+            return pd.DataFrame(columns=RESULT_COLUMNS)  # Return an empty DataFrame on error
+
+    def update_display(self, event=None, delay_ms=0):
+        filters = self.read_filters()
+        get_scheduler(self).submit('filter', lambda: self.filter_books(**filters), self.show_results,
+                                   delay_ms=delay_ms)
+
+    def schedule_update(self, event=None):
+        # Debounced so live filtering only runs once typing pauses
+        self.update_display(delay_ms=DEBOUNCE_MS)
+
+    @timed('filter.render')
+    def show_results(self, results):
+        self.results = results
+        self.top_row = 0
+        self.count_label.config(text=f"{len(self.results):,} books found")
+        self.render_window()
+
+    def visible_rows(self):
+        return max(1, self.result_listbox.winfo_height() // self.row_height - 1)  # less the header
+
+    def render_window(self, event=None):
+        # Only the rows in view (plus a small buffer) are formatted and put in the listbox;
+        # the scrollbar is driven from the position in the full results instead
+        visible = self.visible_rows()
+        self.top_row = max(0, min(self.top_row, len(self.results) - visible))
+        rows = self.results.iloc[self.top_row:self.top_row + visible + RESULT_BUFFER]
+        self.result_listbox.delete(0, tk.END)
+        self.result_listbox.insert(tk.END, f"{'Title':<80}{'Rating':<10}{'Pages':<10}{'Genres'}", *self.format_rows(rows))
+        if len(self.results):
+            self.result_scrollbar.set(self.top_row / len(self.results),
+                                      min(1.0, (self.top_row + visible) / len(self.results)))
+        else:
+            self.result_scrollbar.set(0.0, 1.0)
+
+    def format_rows(self, rows):
+        titles = rows['title'].astype(str).str.slice(0, 60).str.ljust(80)
+        ratings = rows['rating_score'].astype(str).str.ljust(10)
+        pages = rows['num_pages'].astype(str).str.ljust(10)
+        genres = rows['genres'].str.join(', ').str.slice(0, 25)
+        return (titles + ratings + pages + genres).tolist()
+
+    def scroll_results(self, action, amount, unit=None):
+        # Scrollbar commands: ('moveto', fraction) or ('scroll', steps, 'units' | 'pages')
+        if action == 'moveto':
+            self.top_row = int(float(amount) * len(self.results))
+        elif unit == 'pages':
+            self.top_row += int(amount) * self.visible_rows()
+        else:
+            self.top_row += int(amount)
+        self.render_window()
+
+    def on_results_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_results('scroll', -WHEEL_ROWS, 'units')
+        else:
+            self.scroll_results('scroll', WHEEL_ROWS, 'units')
+        return "break"  # the listbox itself never scrolls
 
     def create_widgets(self):
         ttk.Label(self, text="Search Title:").grid(row=0, column=0, padx=5, pady=5, sticky='w')
         self.title_entry = ttk.Entry(self)
         self.title_entry.grid(row=0, column=1, padx=5, pady=5, sticky='ew')
+        self.title_entry.bind("<KeyRelease>", self.schedule_update)
 
         ttk.Label(self, text="Minimum Rating:").grid(row=1, column=0, padx=5, pady=5, sticky='w')
         self.rating_combobox = ttk.Combobox(self, values=["All", 3, 3.5, 4, 4.5], state="readonly")
         self.rating_combobox.grid(row=1, column=1, padx=5, pady=5, sticky='ew')
         self.rating_combobox.set('All')
+        self.rating_combobox.bind("<<ComboboxSelected>>", self.schedule_update)
 
-        ttk.Label(self, text="Genre:").grid(row=2, column=0, padx=5, pady=5, sticky='w')
-        self.genre_combobox = ttk.Combobox(self, values=['All'] + sorted(self.data['genres'].dropna().unique().tolist()), state="readonly")
-        self.genre_combobox.grid(row=2, column=1, padx=5, pady=5, sticky='ew')
-        self.genre_combobox.set('All')
+        ttk.Label(self, text="Genres:").grid(row=2, column=0, padx=5, pady=5, sticky='nw')
+        genre_frame = ttk.Frame(self)
+        genre_frame.grid(row=2, column=1, padx=5, pady=5, sticky='ew')
+        # No selection means any genre
+        self.genre_listbox = tk.Listbox(genre_frame, selectmode=tk.MULTIPLE, height=5, exportselection=0)
+        for genre in self.engine.genre_index.genres:
+            self.genre_listbox.insert(tk.END, genre)
+        self.genre_listbox.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        genre_scrollbar = ttk.Scrollbar(genre_frame, orient="vertical", command=self.genre_listbox.yview)
+        genre_scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+        self.genre_listbox.config(yscrollcommand=genre_scrollbar.set)
+        self.genre_listbox.bind("<<ListboxSelect>>", self.schedule_update)
+        ttk.Label(genre_frame, text="Match:").pack(side=tk.LEFT, padx=(10, 2))
+        self.genre_match_combobox = ttk.Combobox(genre_frame, values=["Any", "All"], state="readonly", width=6)
+        self.genre_match_combobox.pack(side=tk.LEFT, anchor='n')
+        self.genre_match_combobox.set('Any')
+        self.genre_match_combobox.bind("<<ComboboxSelected>>", self.schedule_update)
 
         ttk.Label(self, text="Max Pages:").grid(row=3, column=0, padx=5, pady=5, sticky='w')
         self.pages_combobox = ttk.Combobox(self, values=["All", 100, 300, 500, 1000], state="readonly")
         self.pages_combobox.grid(row=3, column=1, padx=5, pady=5, sticky='ew')
         self.pages_combobox.set('All')
+        self.pages_combobox.bind("<<ComboboxSelected>>", self.schedule_update)
 
         ttk.Button(self, text="Filter Books", command=self.update_display).grid(row=4, column=0, columnspan=2, pady=10)
 
@@ -82,6 +138,14 @@ class FilterBooksPage(tk.Frame):
         # Listbox with a vertical scrollbar
         self.result_listbox = tk.Listbox(list_frame, height=10, width=80, exportselection=0, font=('Courier', 14))
         self.result_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.result_listbox.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.result_listbox.config(yscrollcommand=scrollbar.set)
+        self.result_scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.scroll_results)
+        self.result_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.row_height = tkfont.Font(font=self.result_listbox.cget('font')).metrics('linespace') + 1
+        self.result_listbox.bind("<Configure>", self.render_window)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.result_listbox.bind(sequence, self.on_results_wheel)
+
+        self.count_label = ttk.Label(self, text="")
+        self.count_label.grid(row=6, column=0, columnspan=2, padx=5, pady=(0, 5), sticky='w')
+        self.results = pd.DataFrame(columns=RESULT_COLUMNS)  # until the first filter runs
+        self.top_row = 0
@@ -0,0 +1,158 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from catalog import StringArray, open_array, save_array
+
+EMPTY_POSTING = np.empty(0, dtype=np.int32)
+SCAN_SHARE = 0.02  # above this share of the rows as candidates, one vectorized scan confirms them faster
+
+
+class TrigramIndex:
+    def __init__(self, titles):
+        # Titles are normalized once here instead of on every query
+        titles = normalize_titles(titles)
+        self.titles = StringArray.from_strings(titles)
+        self.gram_ids, self.rows, self.bounds = self.build_postings(titles)
+        self.added = {}  # postings of the rows appended by add(), per trigram
+
+    @staticmethod
+    def build_postings(titles, start=0):
+        # Rows of trigram gram_ids[g] are rows[bounds[g]:bounds[g + 1]], sorted
+        grams = []
+        rows = []
+        for row, title in enumerate(titles, start=start):
+            title_grams = {title[i:i + 3] for i in range(len(title) - 2)}
+            grams.extend(title_grams)
+            rows.extend([row] * len(title_grams))
+        if not grams:
+            return {}, EMPTY_POSTING, np.zeros(1, dtype=np.int64)
+
+        # Group the (trigram, row) pairs by trigram; rows stay sorted within each posting list
+        codes, uniques = pd.factorize(np.array(grams, dtype=object))
+        order = np.argsort(codes, kind='stable')
+        rows = np.asarray(rows, dtype=np.int32)[order]
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        return {gram: i for i, gram in enumerate(uniques)}, rows, bounds
+
+    def add(self, titles):
+        # New rows are numbered after the existing ones, so each posting list stays sorted
+        titles = normalize_titles(titles)
+        start = len(self.titles)
+        self.titles = self.titles.concat(StringArray.from_strings(titles))
+        gram_ids, rows, bounds = self.build_postings(titles, start)
+        for gram, i in gram_ids.items():
+            self.added[gram] = np.concatenate([self.added.get(gram, EMPTY_POSTING), rows[bounds[i]:bounds[i + 1]]])
+
+    def posting(self, gram):
+        i = self.gram_ids.get(gram)
+        rows = EMPTY_POSTING if i is None else self.rows[self.bounds[i]:self.bounds[i + 1]]
+        added = self.added.get(gram)
+        return rows if added is None else np.concatenate([rows, added])
+
+    def search(self, query):
+        # Returns the sorted row positions whose title contains the query
+        query = query.lower()
+        if len(query) < 3:
+            # Too short to have a trigram, fall back to scanning the normalized titles
+            return self.titles.contains(query)
+
+        postings = sorted((self.posting(gram) for gram in {query[i:i + 3] for i in range(len(query) - 2)}), key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+
+        if len(query) > 3 and len(candidates):
+            # Sharing every trigram does not guarantee they are contiguous (or repeated often
+            # enough, as for 'aaaa' against 'aaa'), so confirm the match
+            if len(candidates) > SCAN_SHARE * len(self.titles):
+                candidates = np.intersect1d(candidates, self.titles.contains(query), assume_unique=True)
+            else:
+                candidates = candidates[[query in self.titles[row] for row in candidates]]
+        return candidates
+
+    def save(self, directory):
+        # Only the postings of the saved rows; call before add()
+        self.titles.save(directory, 'titles')
+        save_array(directory, 'posting_rows', self.rows)
+        save_array(directory, 'posting_bounds', self.bounds)
+        with open(os.path.join(directory, 'trigrams.json'), 'w') as f:
+            json.dump(list(self.gram_ids), f)
+
+    @classmethod
+    def open(cls, directory):
+        index = cls.__new__(cls)
+        index.titles = StringArray.open(directory, 'titles')
+        index.rows = open_array(directory, 'posting_rows')
+        index.bounds = open_array(directory, 'posting_bounds')
+        with open(os.path.join(directory, 'trigrams.json')) as f:
+            index.gram_ids = {gram: i for i, gram in enumerate(json.load(f))}
+        index.added = {}
+        return index
+
+
+def normalize_titles(titles):
+    return pd.Series(titles).astype(object).fillna('').astype(str).str.lower().tolist()
+
+
+class GenreIndex:
+    def __init__(self, genre_lists):
+        # genre_lists is a GenreLists; only the genres some book has are listed
+        self.size = len(genre_lists)
+        rows = genre_lists.row_ids()
+        used, codes = np.unique(genre_lists.indices, return_inverse=True)
+        self.genres = [genre_lists.vocabulary[code] for code in used]
+        self.positions = {genre: i for i, genre in enumerate(self.genres)}
+
+        # One packed bitmap per genre, bit r set when book r has that genre
+        self.bitmaps = np.zeros((len(self.genres), (self.size + 7) // 8), dtype=np.uint8)
+        self.set_bits(rows, codes)
+
+    def set_bits(self, rows, codes):
+        bits = np.left_shift(1, 7 - (rows & 7)).astype(np.uint8)
+        np.bitwise_or.at(self.bitmaps, (codes, rows >> 3), bits)
+
+    def add(self, genre_lists):
+        # Appends rows; genres not seen before get a new bitmap
+        for code in np.unique(genre_lists.indices):
+            self.positions.setdefault(genre_lists.vocabulary[code], len(self.positions))
+        self.genres = sorted(self.positions)
+        start = self.size
+        self.size += len(genre_lists)
+        bitmaps = np.zeros((len(self.positions), (self.size + 7) // 8), dtype=np.uint8)
+        bitmaps[:self.bitmaps.shape[0], :self.bitmaps.shape[1]] = self.bitmaps
+        self.bitmaps = bitmaps
+        positions = np.array([self.positions.get(genre, -1) for genre in genre_lists.vocabulary], dtype=np.int64)
+        self.set_bits(genre_lists.row_ids() + start, positions[genre_lists.indices])
+
+    def mask(self, genres, match_all=False):
+        # Boolean row mask of books having any (or all) of the given genres
+        bitmaps = [self.bitmaps[self.positions[genre]] for genre in genres if genre in self.positions]
+        if not bitmaps or (match_all and len(bitmaps) < len(genres)):
+            # An unknown genre can never be matched by every book
+            return np.zeros(self.size, dtype=bool)
+        if match_all:
+            combined = np.bitwise_and.reduce(bitmaps)
+        else:
+            combined = np.bitwise_or.reduce(bitmaps)
+        return np.unpackbits(combined, count=self.size).astype(bool)
+
+    def save(self, directory):
+        save_array(directory, 'genre_bitmaps', self.bitmaps)
+        with open(os.path.join(directory, 'genre_index.json'), 'w') as f:
+            json.dump({'size': self.size, 'genres': self.genres, 'positions': self.positions}, f)
+
+    @classmethod
+    def open(cls, directory):
+        index = cls.__new__(cls)
+        with open(os.path.join(directory, 'genre_index.json')) as f:
+            meta = json.load(f)
+        index.size = meta['size']
+        index.genres = meta['genres']
+        index.positions = meta['positions']
+        index.bitmaps = open_array(directory, 'genre_bitmaps')
+        return index
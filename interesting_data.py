@@ -5,27 +5,39 @@ from tkinter import ttk
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import seaborn as sns
-import pandas as pd
+from cache import LRUCache
+from engine import ChartEngine
+from profiling import stage, timed
+from scheduler import get_scheduler
+
+FIGURE_CACHE_SIZE = 5
+LAYOUT_PARAMS = ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')
 
 
 class InterestingDataPage(tk.Frame):
     def __init__(self, parent, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
 
-        self.df = pd.read_csv('goodreads.csv')
-        self.setup_dataframe()
+        self.engine = ChartEngine.from_catalog()
+        self.df = self.engine.df
 
-        self.fig, self.ax = plt.subplots(figsize=(8, 6))  # Smaller figure size adjusted as before
+        self.fig = plt.figure(figsize=(8, 6))  # Smaller figure size adjusted as before
+        self.ax = None
+        # Every drawn chart keeps its own axes plus a raster of the rendered canvas,
+        # so switching back to it needs neither seaborn nor a full redraw
+        self.figures = LRUCache(FIGURE_CACHE_SIZE, on_evict=self.discard_figure)
         self.canvas = FigureCanvasTkAgg(self.fig, self)
         self.canvas_widget = self.canvas.get_tk_widget()
 
-        self.combobox = ttk.Combobox(self, values=[
-            "Top Books by Voters and Rating",
-            "Distribution of Book Length",
-            "Distribution of Book Formats",
-            "Top 10 Rated Books",
-            "Average ratings of the books of the Top 20 authors"
-        ])
+        # Each chart is prepared by the engine on a worker and drawn here on the Tk thread
+        self.charts = dict(zip(ChartEngine.CHARTS, [
+            self.draw_top_books,
+            self.draw_book_length_distribution,
+            self.draw_book_format_distribution,
+            self.draw_top10_rated_books,
+            self.draw_top20_authors_by_average_rating,
+        ]))
+        self.combobox = ttk.Combobox(self, values=list(self.charts))
         self.combobox.current(0)
         self.combobox.bind("<<ComboboxSelected>>", self.update_graph)
         # Packing and layout code remains the same
@@ -39,33 +51,7 @@ class InterestingDataPage(tk.Frame):
         self.update_graph()  # Initial graph
 
 
-    def setup_dataframe(self):
-        # Convert and prepare data as needed for plotting
-        self.df['Number of voters'] = pd.to_numeric(self.df['num_ratings'], errors='coerce')
-        self.df['Rating'] = pd.to_numeric(self.df['rating_score'], errors='coerce')
-        self.df['Num Pages'] = pd.to_numeric(self.df['num_pages'], errors='coerce')
-        self.df['Book'] = self.df['title']  # Ensure this column is set up correctly
-
-    def prepare_book_format_data(self):
-        # Calculate the total counts and percentages
-        format_counts = self.df['format'].value_counts()
-        total = format_counts.sum()
-        percentages = (format_counts / total) * 100
-
-        # Identify small categories and sum them into 'Others'
-        small_categories = percentages < 3
-        others_sum = format_counts[small_categories].sum()
-
-        # Drop small categories and add 'Others'
-        format_counts = format_counts[~small_categories]
-        if others_sum > 0:
-            format_counts['Others'] = others_sum
-
-        return format_counts
-
-    def draw_book_format_distribution(self):
-        format_counts = self.prepare_book_format_data()
-        self.ax.clear()  # Clear existing plots
+    def draw_book_format_distribution(self, format_counts):
         wedges, texts, autotexts = self.ax.pie(format_counts, labels=format_counts.index, autopct='%1.1f%%',
                                                startangle=140)
 
@@ -77,15 +63,8 @@ class InterestingDataPage(tk.Frame):
                 autotext.set_style('italic')
 
         self.ax.set_title('Pie Chart of Book Formats')
-        self.canvas.draw()
-
-    def draw_top_books(self):
-        # Scale the 'Number of voters' by dividing by 10,000 for better visualization scale
-        self.df['Scaled Voters'] = self.df['Number of voters'] / 10000
-
-        # Sorting data and selecting top 20 books
-        top_books = self.df.sort_values(by=['Scaled Voters', 'Rating'], ascending=False).head(20)
 
+    def draw_top_books(self, top_books):
         # Plotting using seaborn
         barplot = sns.barplot(x='Scaled Voters', y='Book', data=top_books, hue='Book', dodge=False, ax=self.ax)
 
@@ -102,14 +81,12 @@ class InterestingDataPage(tk.Frame):
         self.ax.set_xlabel('Number of Voters (x10,000)')
         self.ax.set_ylabel('Books')
 
-    def draw_book_length_distribution(self):
-        sns.histplot(data=self.df, x='Num Pages', bins=30, kde=True, color='red', ax=self.ax)
+    def draw_book_length_distribution(self, book_lengths):
+        # book_lengths holds pre-binned counts, so the histogram is weighted by them
+        sns.histplot(data=book_lengths, x='Num Pages', weights='Books', bins=30, kde=True, color='red', ax=self.ax)
         self.ax.set_title('Distribution of Book Length')
 
-    def draw_top10_rated_books(self):
-        # Assume you have prepared 'top10_books' with the necessary data
-        top10_books = self.df.nlargest(10, 'Rating')
-        self.ax.clear()
+    def draw_top10_rated_books(self, top10_books):
         barplot = sns.barplot(y='Book', x='Rating', data=top10_books, ax=self.ax, palette="viridis", hue='Book')
         self.ax.set_title('Top 10 Rated Books')
         self.ax.set_xlabel('Book Title')
@@ -119,9 +96,7 @@ class InterestingDataPage(tk.Frame):
                          ha='center', va='bottom')
         self.ax.tick_params(axis='x', rotation=45)
 
-    def draw_top20_authors_by_average_rating(self):
-        author_ratings = self.df.groupby('authors')['Rating'].mean().nlargest(20)
-        self.ax.clear()
+    def draw_top20_authors_by_average_rating(self, author_ratings):
         author_ratings.plot(kind='bar', ax=self.ax, colormap='summer')
         self.ax.set_title('Top 20 Authors by Average Book Rating')
         self.ax.set_xlabel('Author Name')
@@ -129,23 +104,52 @@ class InterestingDataPage(tk.Frame):
         self.ax.tick_params(axis='x', rotation=45)
 
     def update_graph(self, event=None):
-        self.ax.clear()
         graph_type = self.combobox.get()
-
-        if graph_type == "Top Books by Voters and Rating":
-            self.draw_top_books()
-        elif graph_type == "Distribution of Book Length":
-            self.draw_book_length_distribution()
-        elif graph_type == "Distribution of Book Formats":
-            self.draw_book_format_distribution()
-        elif graph_type == "Top 10 Rated Books":
-            self.draw_top10_rated_books()
-        elif graph_type == "Average ratings of the books of the Top 20 authors":
-            self.draw_top20_authors_by_average_rating()
-
-        self.fig.tight_layout()
-        self.canvas.draw()
-
-
-
-
+        if graph_type not in self.charts:
+            return
+        version = self.engine.version
+        self.figures.invalidate(lambda key: key[1] != version)
+        key = (graph_type, version)
+        if key in self.figures:
+            self.show_cached_graph(key)
+            return
+        draw = self.charts[graph_type]
+        get_scheduler(self).submit('interesting_data', lambda: self.engine.prepare(graph_type),
+                                   lambda data: self.render_graph(key, draw, data))
+
+    def render_graph(self, key, draw, data):
+        self.ax = self.fig.add_subplot(111)
+        self.show_only(self.ax)
+        with stage('charts.draw'):
+            draw(data)
+        with stage('charts.canvas_draw'):
+            self.fig.tight_layout()
+            self.canvas.draw()
+        self.figures.put(key, {
+            'axes': self.ax,
+            'layout': {name: getattr(self.fig.subplotpars, name) for name in LAYOUT_PARAMS},
+            'raster': self.canvas.copy_from_bbox(self.fig.bbox),
+            'size': self.canvas.get_width_height(),
+        })
+
+    @timed('charts.show_cached')
+    def show_cached_graph(self, key):
+        figure = self.figures.get(key)
+        self.ax = figure['axes']
+        self.show_only(self.ax)
+        self.fig.subplots_adjust(**figure['layout'])
+        if figure['size'] == self.canvas.get_width_height():
+            # Same canvas size as when it was rendered, so the stored pixels are still exact
+            self.canvas.restore_region(figure['raster'])
+            self.canvas.blit(self.fig.bbox)
+        else:
+            self.canvas.draw()
+            figure['raster'] = self.canvas.copy_from_bbox(self.fig.bbox)
+            figure['size'] = self.canvas.get_width_height()
+
+    def show_only(self, ax):
+        for other in self.fig.axes:
+            other.set_visible(other is ax)
+
+    def discard_figure(self, key, figure):
+        self.fig.delaxes(figure['axes'])
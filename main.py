@@ -1,50 +1,123 @@
+import argparse
+import importlib
+import os
+import threading
 import tkinter as tk
 from tkinter import ttk
-from filter import FilterBooksPage
-from book_recommendation import BookRecommendationPage
-from data_visualization import DataVisualizationPage
-from interesting_data import InterestingDataPage
+
+from profiling import profiler, stage
+from scheduler import shutdown_scheduler
+
+# Tab text, module and page class. Page modules (and the sklearn/seaborn/matplotlib
+# imports they pull in) are only loaded when their tab is first needed.
+PAGES = [
+    ('Book Filtering', 'filter', 'FilterBooksPage'),
+    ('Book Recommendation', 'book_recommendation', 'BookRecommendationPage'),
+    ('Interesting Data', 'interesting_data', 'InterestingDataPage'),
+    ('Data Visualization', 'data_visualization', 'DataVisualizationPage'),
+]
+WARM_UP_DELAY_MS = 200
+STATUS_INTERVAL_MS = 500
 
 
 def show_page(page):
     page.lift()
 
 
+def build_page(index):
+    if index not in pages:
+        text, module_name, class_name = PAGES[index]
+        with stage(f'page.build.{module_name}'):
+            page_class = getattr(importlib.import_module(module_name), class_name)
+            page = page_class(tabs[index])
+        page.pack(expand=True, fill="both")
+        pages[index] = page
+    return pages[index]
+
+
+def on_tab_changed(event=None):
+    build_page(tab_control.index(tab_control.select()))
+
+
+def update_status():
+    status_label.config(text=profiler.status_text())
+    root.after(STATUS_INTERVAL_MS, update_status)
+
+
+def on_close():
+    if args.trace:
+        profiler.export_trace(args.trace)
+        print(f"Trace written to {args.trace}")
+    running = shutdown_scheduler(root)
+    root.destroy()
+    if running:
+        # A job already running (an index build, say) cannot be interrupted, and its
+        # result is no longer wanted, so exit without waiting for its thread
+        os._exit(0)
+
+
+def import_page_modules():
+    for text, module_name, class_name in PAGES:
+        importlib.import_module(module_name)
+
+
+def warm_up(importer):
+    # Widgets must be created on the Tk thread, so wait for the background imports
+    # and then build one remaining page per idle slot to keep the UI responsive
+    if importer.is_alive():
+        root.after(WARM_UP_DELAY_MS, warm_up, importer)
+        return
+    remaining = [index for index in range(len(PAGES)) if index not in pages]
+    if remaining:
+        build_page(remaining[0])
+        root.after(WARM_UP_DELAY_MS, warm_up, importer)
+
+
+parser = argparse.ArgumentParser(description="NextPage")
+parser.add_argument('--no-warm-up', action='store_true', help="only build a tab when it is first selected")
+parser.add_argument('--profile', action='store_true', help="time every load, query and render stage")
+parser.add_argument('--trace', metavar='PATH', help="write a Chrome trace of the timed stages on exit")
+parser.add_argument('--cprofile', metavar='STAGE', help="profile the next run of one stage, e.g. filter.query")
+args = parser.parse_args()
+
+# Timing hooks stay no-ops unless profiling was asked for
+if args.profile or args.trace or args.cprofile:
+    profiler.enable()
+if args.cprofile:
+    profiler.capture_next(args.cprofile)
+
 root = tk.Tk()
 root.title("NextPage")
 root.geometry('1350x600')
 
 # Tabs
 tab_control = ttk.Notebook(root)
-filter_tab = tk.Frame(tab_control)
-recommendation_tab = tk.Frame(tab_control)
-interesting_data_tab = tk.Frame(tab_control)
-visualization_tab = tk.Frame(tab_control)
-
-tab_control.add(filter_tab, text='Book Filtering')
-tab_control.add(recommendation_tab, text='Book Recommendation')
-tab_control.add(interesting_data_tab, text='Interesting Data')
-tab_control.add(visualization_tab, text='Data Visualization')
+tabs = []
+pages = {}
+for text, module_name, class_name in PAGES:
+    tab = tk.Frame(tab_control)
+    tab_control.add(tab, text=text)
+    tabs.append(tab)
 tab_control.pack(expand=1, fill="both")
+tab_control.bind("<<NotebookTabChanged>>", on_tab_changed)
 
-# Filter Page
-filter_page = FilterBooksPage(filter_tab)
-filter_page.pack(expand=True, fill="both")
-
-# Recommendation Page
-recommendation_page = BookRecommendationPage(recommendation_tab)
-recommendation_page.pack(expand=True, fill="both")
+# Latency of the last timed stage, only shown while profiling
+if profiler.enabled:
+    status_label = ttk.Label(root, text=profiler.status_text(), anchor='w')
+    status_label.pack(side="bottom", fill="x")
+    root.after(STATUS_INTERVAL_MS, update_status)
+root.protocol("WM_DELETE_WINDOW", on_close)
 
-# interesting data
-interesting_data = InterestingDataPage(interesting_data_tab)
-interesting_data.pack(expand=True, fill="both")
-
-# Visualization Page
-visualization_page = DataVisualizationPage(visualization_tab)
-visualization_page.pack(expand=True, fill="both")
+# Filter Page is shown first, everything else is built on demand
+build_page(0)
 
 # Navigation Buttons
 nav_frame = tk.Frame(root)
 nav_frame.pack(side="top", fill="x", expand=False)
 
-root.mainloop()
\ No newline at end of file
+if not args.no_warm_up:
+    importer = threading.Thread(target=import_page_modules, daemon=True)
+    importer.start()
+    root.after(WARM_UP_DELAY_MS, warm_up, importer)
+
+root.mainloop()
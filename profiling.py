@@ -0,0 +1,139 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+# Stage timings for load, query and render steps. Code wraps a step in
+#   with stage('filter.query'):
+# or decorates a whole function with @timed('filter.query'); either costs one
+# attribute check while profiling is off.
+
+HISTORY_SIZE = 200  # latencies kept per stage for the average and p95
+TRACE_SIZE = 100_000  # events kept for the Chrome trace export
+PROFILE_LINES = 25
+
+_DISABLED = nullcontext()
+
+
+class Stage:
+    __slots__ = ('profiler', 'name', 'start', 'capture')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.capture = self.profiler.start_capture(self.name)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        if self.capture is not None:
+            self.capture.disable()
+            self.profiler.finish_capture(self.name, self.capture)
+        self.profiler.record(self.name, self.start, end)
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.history = {}
+        self.events = deque(maxlen=TRACE_SIZE)
+        self.last_stage = None
+        self.origin = time.perf_counter_ns()
+        self.capture_stage = None
+        self.capture_path = None
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def stage(self, name):
+        if not self.enabled:
+            return _DISABLED
+        return Stage(self, name)
+
+    def record(self, name, start, end):
+        with self.lock:
+            self.history.setdefault(name, deque(maxlen=HISTORY_SIZE)).append((end - start) / 1e6)
+            self.events.append((name, start, end, threading.get_ident()))
+            self.last_stage = name
+
+    def summary(self, name):
+        # (last, average, p95) in milliseconds, or None before the stage has run
+        with self.lock:
+            latencies = list(self.history.get(name, ()))
+        if not latencies:
+            return None
+        ordered = sorted(latencies)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+        return latencies[-1], sum(latencies) / len(latencies), p95
+
+    def status_text(self):
+        name = self.last_stage
+        summary = self.summary(name) if name else None
+        if summary is None:
+            return "No timings yet"
+        last, average, p95 = summary
+        return f"{name}: last {last:.1f} ms, avg {average:.1f} ms, p95 {p95:.1f} ms"
+
+    def capture_next(self, name, path=None):
+        # The next run of this stage is profiled with cProfile and written to path
+        with self.lock:
+            self.capture_stage = name
+            self.capture_path = path or f"{name}.prof"
+
+    def start_capture(self, name):
+        if self.capture_stage != name:
+            return None
+        with self.lock:
+            if self.capture_stage != name:
+                return None
+            self.capture_stage = None
+        capture = cProfile.Profile()
+        capture.enable()
+        return capture
+
+    def finish_capture(self, name, capture):
+        capture.dump_stats(self.capture_path)
+        report = io.StringIO()
+        pstats.Stats(capture, stream=report).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        print(f"Profile of {name} written to {self.capture_path}")
+        print(report.getvalue())
+
+    def export_trace(self, path):
+        # Chrome trace event format: open in chrome://tracing or https://ui.perfetto.dev
+        with self.lock:
+            events = list(self.events)
+        trace = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+                  'ts': (start - self.origin) / 1e3, 'dur': (end - start) / 1e3}
+                 for name, start, end, thread in events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+profiler = Profiler()
+
+
+def stage(name):
+    return profiler.stage(name)
+
+
+def timed(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with Stage(profiler, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from catalog import load_catalog, save_array
+from recommender import RecommendationEngine, normalize_title, score_block_rows, top_k
+
+TABLE_DIR_NAME = 'recommendation_table'
+TABLE_SIZE = 20  # neighbours stored per title
+CHUNK_SIZE = 256  # most rows scored per task; fewer on large catalogs (see score_block_rows)
+FULL_REBUILD_FRACTION = 0.25  # above this share of changed rows a refresh rebuilds everything
+
+
+class RecommendationTable:
+    def __init__(self, directory, meta, titles, neighbours, scores, row_hashes):
+        self.directory = directory
+        self.version = meta['version']
+        self.size = meta['size']
+        self.titles = titles
+        self.title_rows = {normalize_title(title): row for row, title in enumerate(titles)}
+        self.neighbours = neighbours
+        self.scores = scores
+        self.row_hashes = row_hashes
+
+    @classmethod
+    def open(cls, directory):
+        # The arrays are memory-mapped, so opening costs little beyond reading the titles
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            with open(os.path.join(directory, 'titles.json')) as f:
+                titles = json.load(f)
+            arrays = [np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                      for name in ('neighbours', 'scores', 'row_hashes')]
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(directory, meta, titles, *arrays)
+
+    def lookup(self, title, num_recommendations=10, row_hash=None):
+        # None means the caller should compute live: unknown title, too many results
+        # asked for, or the book's features changed since the table was built
+        row = self.title_rows.get(normalize_title(title))
+        if row is None or num_recommendations > self.size:
+            return None
+        if row_hash is not None and self.row_hashes[row] != row_hash:
+            return None
+        neighbours = self.neighbours[row, :num_recommendations]
+        neighbours = neighbours[neighbours >= 0]
+        return [self.titles[i] for i in neighbours], np.asarray(self.scores[row, :len(neighbours)])
+
+
+def row_hashes(features):
+    # One 64-bit fingerprint per feature row, used to find the books that changed
+    with np.errstate(over='ignore'):
+        values = features.indices.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        values ^= features.data.astype(np.float32).view(np.uint32).astype(np.uint64) << np.uint64(17)
+        values = (values ^ (values >> np.uint64(31))) * np.uint64(0xBF58476D1CE4E5B9)
+        hashes = np.zeros(features.shape[0], dtype=np.uint64)
+        lengths = np.diff(features.indptr)
+        filled = lengths > 0
+        hashes[filled] = np.add.reduceat(values, features.indptr[:-1][filled])
+    return hashes
+
+
+_features = None
+
+
+def init_worker(features):
+    global _features
+    _features = features
+
+
+def score_rows(rows, size):
+    # Sparse x dense: every row shares the rating column, so the product is dense anyway
+    scores = (_features @ _features[rows].T.toarray()).T
+    neighbours = np.full((len(rows), size), -1, dtype=np.int32)
+    best_scores = np.zeros((len(rows), size), dtype=np.float32)
+    for i, row in enumerate(rows):
+        best = top_k(scores[i], size, exclude=row)
+        neighbours[i, :len(best)] = best
+        best_scores[i, :len(best)] = scores[i, best]
+    return neighbours, best_scores
+
+
+def compute_rows(features, rows, size, workers=None):
+    neighbours = np.full((len(rows), size), -1, dtype=np.int32)
+    scores = np.zeros((len(rows), size), dtype=np.float32)
+    # Each task holds a dense block of scores against every title, so its row count
+    # shrinks as the catalog grows
+    chunk_size = score_block_rows(features.shape[0], CHUNK_SIZE)
+    chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+    if not chunks:
+        return neighbours, scores
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(features,)) as pool:
+        offset = 0
+        for chunk_neighbours, chunk_scores in pool.map(score_rows, chunks, repeat(size)):
+            neighbours[offset:offset + len(chunk_neighbours)] = chunk_neighbours
+            scores[offset:offset + len(chunk_scores)] = chunk_scores
+            offset += len(chunk_neighbours)
+    return neighbours, scores
+
+
+def merge_changed(engine, neighbours, scores, rows, changed, size):
+    # For rows whose stored neighbours are all still valid, the new top list is the best
+    # of the old list and the rows whose features changed
+    query = engine.features[changed]
+    chunk_size = score_block_rows(len(changed) + size, CHUNK_SIZE)
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        changed_scores = engine.features[chunk] @ query.T.toarray()
+        candidate_rows = np.hstack([neighbours[chunk], np.broadcast_to(changed, (len(chunk), len(changed)))])
+        candidate_scores = np.hstack([scores[chunk], changed_scores])
+        candidate_scores[candidate_rows < 0] = -np.inf
+        order = np.argsort(-candidate_scores, axis=1, kind='stable')[:, :size]
+        neighbours[chunk] = np.take_along_axis(candidate_rows, order, axis=1)
+        scores[chunk] = np.take_along_axis(candidate_scores, order, axis=1)
+        neighbours[chunk] = np.where(np.isinf(scores[chunk]), -1, neighbours[chunk])
+        scores[chunk] = np.where(np.isinf(scores[chunk]), 0, scores[chunk])
+
+
+def build_table(engine, directory, version='', size=TABLE_SIZE, workers=None, full=False):
+    hashes = row_hashes(engine.features)
+    previous = None if full else RecommendationTable.open(directory)
+    if previous is not None and previous.size != size:
+        previous = None
+
+    all_rows = np.arange(len(engine.titles))
+    if previous is None:
+        neighbours, scores = compute_rows(engine.features, all_rows, size, workers)
+        refreshed = len(all_rows)
+    else:
+        # Map every current row to its row in the old table (-1 for new titles)
+        old_rows = np.array([previous.title_rows.get(normalize_title(title), -1) for title in engine.titles])
+        known = old_rows >= 0
+        unchanged = known.copy()
+        unchanged[known] = np.asarray(previous.row_hashes)[old_rows[known]] == hashes[known]
+        changed = np.flatnonzero(~unchanged)
+
+        # Old neighbour ids translated to current rows; neighbours that were removed or
+        # changed invalidate the stored list, so those rows are recomputed in full
+        translate = np.full(len(previous.titles) + 1, -1, dtype=np.int64)
+        translate[old_rows[unchanged]] = np.flatnonzero(unchanged)
+        neighbours = np.full((len(all_rows), size), -1, dtype=np.int32)
+        scores = np.zeros((len(all_rows), size), dtype=np.float32)
+        neighbours[unchanged] = translate[np.asarray(previous.neighbours)[old_rows[unchanged]]]
+        scores[unchanged] = np.asarray(previous.scores)[old_rows[unchanged]]
+        stale = np.asarray(previous.neighbours)[old_rows[unchanged]]
+        stale = ((stale >= 0) & (neighbours[unchanged] < 0)).any(axis=1)
+        recompute = np.union1d(changed, np.flatnonzero(unchanged)[stale])
+
+        if len(recompute) > FULL_REBUILD_FRACTION * len(all_rows):
+            neighbours, scores = compute_rows(engine.features, all_rows, size, workers)
+            refreshed = len(all_rows)
+        else:
+            if len(changed):
+                merge_rows = np.setdiff1d(all_rows, recompute)
+                merge_changed(engine, neighbours, scores, merge_rows, changed, size)
+            neighbours[recompute], scores[recompute] = compute_rows(engine.features, recompute, size, workers)
+            refreshed = len(recompute)
+
+    write_table(directory, engine.titles, neighbours, scores, hashes, {'version': version, 'size': size})
+    return refreshed
+
+
+def write_table(directory, titles, neighbours, scores, hashes, meta):
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name, array in (('neighbours', neighbours), ('scores', scores), ('row_hashes', hashes)):
+        save_array(directory, name, array)
+    with open(os.path.join(directory, 'titles.json'), 'w') as f:
+        json.dump(list(titles), f)
+    # meta.json last, so a partly written table is never opened
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+
+def table_directory(catalog):
+    return os.path.join(catalog.cache_dir, TABLE_DIR_NAME)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the top-N recommendations for every title")
+    parser.add_argument('--csv', default='goodreads.csv')
+    parser.add_argument('--size', type=int, default=TABLE_SIZE, help="neighbours stored per title")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--full', action='store_true', help="rebuild every row instead of only changed ones")
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.csv)
+    engine = RecommendationEngine.from_catalog(catalog)
+    refreshed = build_table(engine, table_directory(catalog), catalog.version, args.size, args.workers, args.full)
+    print(f"Refreshed {refreshed:,} of {len(engine.titles):,} titles")
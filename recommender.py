@@ -0,0 +1,253 @@
+import json
+import os
+from bisect import bisect_left
+
+from ann import LSHIndex, lsh_params, recall_at_k
+from catalog import GenreLists, StringArray, open_array, save_array
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+MAX_RATING = 5.0
+BATCH_SIZE = 256  # most queries scored per matrix multiply in recommend_many
+SCORE_BLOCK_BYTES = 64 << 20  # cap on one dense block of scores (queries x titles, float32)
+TEXT_WEIGHT = 0.0  # share of the score taken from description similarity; 0 leaves descriptions out
+
+
+def normalize_title(title):
+    return ' '.join(str(title).lower().split())
+
+
+class RecommendationEngine:
+    def __init__(self, titles, genres, ratings):
+        # genres is a GenreLists with one row per title
+        self.titles = list(titles)
+        self.title_rows = {}
+        for row, title in enumerate(self.titles):
+            self.title_rows.setdefault(normalize_title(title), row)
+
+        self.genres = genres.vocabulary
+        self.features = feature_matrix(genres, ratings, len(self.genres))
+        self.approximate = False
+        self.ann_index = None
+        self.ann_recall = None
+        self.text_vectors = None
+        self.text_weight = 0.0
+
+    @classmethod
+    def from_frame(cls, data, genres=None):
+        return cls(*title_aggregates(data, genres))
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        return cls.from_frame(catalog.view(), catalog.genres)
+
+    def save(self, directory):
+        # Titles, lookup keys and features as .npy files that open() memory-maps
+        os.makedirs(directory, exist_ok=True)
+        StringArray.from_strings(self.titles).save(directory, 'titles')
+        keys = sorted(self.title_rows)
+        StringArray.from_strings(keys).save(directory, 'lookup_keys')
+        save_array(directory, 'lookup_rows', np.array([self.title_rows[key] for key in keys], dtype=np.int64))
+        for name in ('data', 'indices', 'indptr'):
+            save_array(directory, f'features.{name}', getattr(self.features, name))
+        with open(os.path.join(directory, 'features.json'), 'w') as f:
+            json.dump({'shape': self.features.shape, 'genres': self.genres}, f)
+
+    @classmethod
+    def open(cls, directory):
+        # Query-only engine over the mapped arrays; update() is not supported
+        engine = cls.__new__(cls)
+        engine.titles = StringArray.open(directory, 'titles')
+        engine.title_rows = TitleLookup(StringArray.open(directory, 'lookup_keys'),
+                                        open_array(directory, 'lookup_rows'))
+        with open(os.path.join(directory, 'features.json')) as f:
+            meta = json.load(f)
+        engine.genres = meta['genres']
+        engine.features = sparse.csr_matrix(tuple(open_array(directory, f'features.{name}')
+                                                  for name in ('data', 'indices', 'indptr')),
+                                            shape=tuple(meta['shape']), copy=False)
+        engine.approximate = False
+        engine.ann_index = None
+        engine.ann_recall = None
+        engine.text_vectors = None
+        engine.text_weight = 0.0
+        return engine
+
+    def use_text(self, vectors, weight=TEXT_WEIGHT):
+        # Blends cosine similarity of L2-normalized description vectors (one row per
+        # title) into every score: (1 - weight) * genres and rating + weight * text
+        self.text_vectors = vectors
+        self.text_weight = weight if vectors is not None else 0.0
+
+    def update(self, titles, genres, ratings, text_vectors=None):
+        # Replaces the features of titles already known and appends the others. genres
+        # may use a vocabulary extended with new genres; those become new columns.
+        if len(genres.vocabulary) > len(self.genres):
+            # The rating column is always last, so it moves past the new genre columns
+            indices = self.features.indices.copy()
+            indices[indices == len(self.genres)] = len(genres.vocabulary)
+            self.features = sparse.csr_matrix((self.features.data, indices, self.features.indptr),
+                                              shape=(len(self.titles), len(genres.vocabulary) + 1))
+            self.genres = genres.vocabulary
+        size = len(self.titles)
+        titles = np.asarray(list(titles), dtype=object)
+        rows = np.array([self.title_rows.get(normalize_title(title), -1) for title in titles], dtype=np.int64)
+        known = np.array([row >= 0 and self.titles[row] == title for row, title in zip(rows, titles)], dtype=bool)
+
+        # Stack the new rows under the old ones, then pick each title's current row
+        stacked = sparse.vstack([self.features, feature_matrix(genres, ratings, len(self.genres))], format='csr')
+        order = np.concatenate([np.arange(size), size + np.flatnonzero(~known)])
+        order[rows[known]] = size + np.flatnonzero(known)
+        self.features = stacked[order]
+        if self.text_vectors is not None:
+            if text_vectors is None:
+                text_vectors = np.zeros((len(titles), self.text_vectors.shape[1]), dtype=np.float32)
+            self.text_vectors = np.vstack([self.text_vectors, text_vectors])[order]
+        for title in titles[~known]:
+            self.title_rows.setdefault(normalize_title(title), len(self.titles))
+            self.titles.append(title)
+        # The LSH index no longer covers every row; it is rebuilt on the next approximate query
+        self.ann_index = None
+        self.ann_recall = None
+
+    def lookup(self, title):
+        return self.title_rows.get(normalize_title(title))
+
+    def use_approximate(self, approximate=True, index_path=None, version='', **index_params):
+        # Switch between exact scoring and the LSH index, loading the index from
+        # index_path when it matches this dataset version and these parameters, and
+        # building it otherwise
+        self.approximate = approximate
+        if approximate and (self.ann_index is None or self.ann_index.params != lsh_params(**index_params)):
+            index = LSHIndex.load(index_path, version, **index_params) if index_path else None
+            if index is None:
+                index = LSHIndex.build(self.features, version=version, **index_params)
+                # Recall is measured once per build and saved with the index
+                self.ann_index = index
+                index.recall = recall_at_k(self)
+                if index_path:
+                    try:
+                        index.save(index_path)
+                    except OSError as e:
+                        print("Could not save recommendation index:", e)
+            self.ann_index = index
+            self.ann_recall = index.recall
+
+    def recommend(self, title, num_recommendations=10):
+        row = self.lookup(title)
+        if row is None:
+            return [], []
+        return self.recommend_row(row, num_recommendations, self.approximate)
+
+    def recommend_row(self, row, num_recommendations=10, approximate=False):
+        query = self.features[row]
+        if approximate and self.ann_index is not None:
+            # Only the rows sharing an LSH bucket with the query are scored
+            candidates = self.ann_index.candidates(query)
+            scores = self.blend(self.features[candidates].dot(query.toarray().ravel()), row, candidates)
+            best = top_k(scores, num_recommendations, exclude=np.flatnonzero(candidates == row))
+            return [self.titles[candidates[i]] for i in best], scores[best]
+        # Rows are L2-normalized, so a dot product is the cosine similarity
+        scores = self.blend(self.features.dot(query.toarray().ravel()), row)
+        best = top_k(scores, num_recommendations, exclude=row)
+        return [self.titles[i] for i in best], scores[best]
+
+    def blend(self, scores, row, candidates=None):
+        if not self.text_weight:
+            return scores
+        text = self.text_vectors if candidates is None else self.text_vectors[candidates]
+        return (1 - self.text_weight) * scores + self.text_weight * (text @ self.text_vectors[row])
+
+    def recommend_many(self, titles, num_recommendations=10):
+        # Returns one (titles, scores) pair per query, scoring whole batches at once
+        rows = [self.lookup(title) for title in titles]
+        found = [i for i, row in enumerate(rows) if row is not None]
+        results = [([], [])] * len(rows)
+        batch_size = score_block_rows(len(self.titles), BATCH_SIZE)
+        for start in range(0, len(found), batch_size):
+            batch = found[start:start + batch_size]
+            batch_rows = [rows[i] for i in batch]
+            scores = (self.features @ self.features[batch_rows].T.toarray()).T
+            if self.text_weight:
+                scores = ((1 - self.text_weight) * scores
+                          + self.text_weight * (self.text_vectors[batch_rows] @ self.text_vectors.T))
+            for i, row, row_scores in zip(batch, batch_rows, scores):
+                best = top_k(row_scores, num_recommendations, exclude=row)
+                results[i] = ([self.titles[j] for j in best], row_scores[best])
+        return results
+
+
+class TitleLookup:
+    # The title_rows mapping over sorted keys, searched by bisection
+    def __init__(self, keys, rows):
+        self.keys = keys
+        self.rows = rows
+
+    def get(self, key, default=None):
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.rows[i])
+        return default
+
+
+def title_aggregates(data, genres=None):
+    # One entry per title: the union of its books' genres and its mean rating
+    if genres is None:
+        genres = GenreLists.parse(data['genres'])
+    title_codes, titles = pd.factorize(data['title'].to_numpy(dtype=object), sort=True)
+    found = title_codes >= 0
+    ratings = pd.to_numeric(data['rating_score'], errors='coerce').to_numpy(dtype=float)
+    rated = found & ~np.isnan(ratings)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_ratings = (np.bincount(title_codes[rated], weights=ratings[rated], minlength=len(titles))
+                        / np.bincount(title_codes[rated], minlength=len(titles)))
+
+    # Distinct (title, genre) pairs, ordered by title and then genre code
+    width = max(len(genres.vocabulary), 1)
+    pair_titles = title_codes[genres.row_ids()]
+    pairs = np.unique(pair_titles[pair_titles >= 0].astype(np.int64) * width + genres.indices[pair_titles >= 0])
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(pairs // width, minlength=len(titles)))])
+    title_genres = GenreLists(indptr, (pairs % width).astype(np.int32), genres.vocabulary)
+    return titles, title_genres, mean_ratings
+
+
+def feature_matrix(genres, ratings, width):
+    # Genre one-hot plus the scaled rating as the last column, stored sparse so
+    # memory grows with the number of genre assignments rather than books x genres
+    codes = genres.indices
+    rows = genres.row_ids()
+    ratings = np.nan_to_num(np.asarray(ratings, dtype=np.float32) / MAX_RATING)
+    values = np.concatenate([np.ones(len(codes), dtype=np.float32), ratings])
+    feature_rows = np.concatenate([rows, np.arange(len(ratings))])
+    feature_columns = np.concatenate([codes, np.full(len(ratings), width)])
+    features = sparse.csr_matrix((values, (feature_rows, feature_columns)), shape=(len(ratings), width + 1))
+    # A genre listed twice for a book still counts once
+    features.sum_duplicates()
+    features.data[features.indices < width] = 1
+    return normalize_rows(features)
+
+
+def normalize_rows(features):
+    norms = np.sqrt(np.asarray(features.multiply(features).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ features).tocsr().astype(np.float32)
+
+
+def score_block_rows(num_titles, limit):
+    # Queries to score together so the dense block of scores stays under SCORE_BLOCK_BYTES
+    return max(1, min(limit, SCORE_BLOCK_BYTES // (4 * max(num_titles, 1))))
+
+
+def top_k(scores, k, exclude=None):
+    # Partial selection of the k best rows, then a sort of just those k
+    scores = scores.copy()
+    if exclude is not None:
+        scores[exclude] = -np.inf
+        k = min(k, len(scores) - np.size(exclude))
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind='stable')]
@@ -0,0 +1,102 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+POLL_INTERVAL_MS = 25
+DEBOUNCE_MS = 250
+
+
+class TaskScheduler:
+    def __init__(self, root, max_workers=MAX_WORKERS):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='nextpage-worker')
+        self.finished = queue.Queue()
+        self.generations = {}
+        self.futures = {}
+        self.debounce_ids = {}
+        self.polling = False
+
+    def submit(self, key, job, callback, delay_ms=0, on_error=None):
+        # Jobs run on a worker thread; callback(result) runs on the Tk thread. Any newer
+        # submit with the same key supersedes this one, so only the latest result is shown.
+        generation = self.generations.get(key, 0) + 1
+        self.generations[key] = generation
+        if key in self.debounce_ids:
+            self.root.after_cancel(self.debounce_ids.pop(key))
+        future = self.futures.pop(key, None)
+        if future is not None:
+            future.cancel()  # only succeeds if the job has not started yet
+
+        if delay_ms:
+            self.debounce_ids[key] = self.root.after(delay_ms, self.start, key, generation, job, callback, on_error)
+        else:
+            self.start(key, generation, job, callback, on_error)
+
+    def is_current(self, key, generation):
+        return self.generations.get(key) == generation
+
+    def start(self, key, generation, job, callback, on_error):
+        self.debounce_ids.pop(key, None)
+        self.futures[key] = self.executor.submit(self.run, key, generation, job, callback, on_error)
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_INTERVAL_MS, self.poll)
+
+    def run(self, key, generation, job, callback, on_error):
+        if not self.is_current(key, generation):
+            return
+        try:
+            self.finished.put((key, generation, callback, job()))
+        except Exception as e:
+            self.finished.put((key, generation, on_error or report_error, e))
+
+    def poll(self):
+        # Tk is not thread-safe, so results are handed over through a queue drained here
+        try:
+            while True:
+                try:
+                    key, generation, callback, result = self.finished.get_nowait()
+                except queue.Empty:
+                    break
+                if self.is_current(key, generation):
+                    self.futures.pop(key, None)
+                    try:
+                        callback(result)
+                    except Exception as e:
+                        # One failing callback must not keep the other pages from their results
+                        report_error(e)
+        finally:
+            if self.busy() or not self.finished.empty():
+                self.root.after(POLL_INTERVAL_MS, self.poll)
+            else:
+                self.polling = False
+
+    def busy(self):
+        return any(not future.done() for future in self.futures.values())
+
+    def shutdown(self):
+        # Queued jobs are dropped; returns whether a job is still running
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        return self.busy()
+
+
+def report_error(error):
+    print("Error:", error)
+
+
+_schedulers = {}
+
+
+def shutdown_scheduler(widget):
+    # Returns whether a job of this window is still running
+    scheduler = _schedulers.pop(str(widget.winfo_toplevel()), None)
+    return scheduler is not None and scheduler.shutdown()
+
+
+def get_scheduler(widget):
+    # All pages in one window share a single worker pool
+    root = widget.winfo_toplevel()
+    key = str(root)
+    if key not in _schedulers:
+        _schedulers[key] = TaskScheduler(root)
+    return _schedulers[key]
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from cache import TTLCache
+from cli import init_worker, prepare_workers, run_query
+
+# Local JSON service over HTTP, for several clients sharing one catalog:
+#   GET  /filter?title_search=war&min_rating=4&max_pages=500&genres=History&genres=War&match_all=1&limit=50
+#   GET  /recommend?title=Dune&count=10&approximate=0
+#   GET  /chart?chart=Top+10+Rated+Books
+#   POST /query  with a body in cli.py's query format, e.g. {"type": "recommend", "title": "Dune"}
+#   GET  /health  catalog version and cache and coalescing counts
+# Queries run on a process pool. The filter and recommendation engines are stored once
+# under the catalog cache (see engine.save_shared_engines) and every worker memory-maps
+# those files, along with the recommendation table and description vectors, so the
+# arrays are held once. The approximate index is still loaded by each worker using it.
+
+HOST = '127.0.0.1'
+PORT = 8765
+CACHE_SIZE = 1024  # responses kept
+CACHE_TTL = 300  # seconds a response is served from the cache
+READ_TIMEOUT = 10  # seconds to wait for a request
+MAX_BODY = 1 << 20
+
+# Query string parameters and how each is converted, per query type
+PARAMETERS = {
+    'filter': {'title_search': str, 'min_rating': str, 'max_pages': str, 'genres': list, 'match_all': bool,
+               'limit': int},
+    'recommend': {'title': str, 'count': int, 'approximate': bool},
+    'chart': {'chart': str},
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def query_from_url(kind, query_string):
+    values = parse_qs(query_string)
+    query = {'type': kind}
+    for name, convert in PARAMETERS[kind].items():
+        if name not in values:
+            continue
+        if convert is list:
+            query[name] = values[name]
+        elif convert is bool:
+            query[name] = values[name][-1].lower() in ('1', 'true', 'yes')
+        else:
+            try:
+                query[name] = convert(values[name][-1])
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, f"{name} must be a number")
+    return query
+
+
+class QueryService:
+    def __init__(self, csv_path, workers=None, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL, text_weight=0.0):
+        # The engines are stored here once, so the workers only have to map them
+        worker_args = prepare_workers(csv_path, text_weight)
+        self.version = worker_args[2]
+        self.workers = workers or os.cpu_count()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=worker_args)
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.in_flight = {}
+        self.counts = {'requests': 0, 'cache_hits': 0, 'coalesced': 0, 'computed': 0}
+
+    async def query(self, query):
+        # Answered from the cache, by joining an identical query already running, or on the pool
+        self.counts['requests'] += 1
+        key = json.dumps(query, sort_keys=True)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.counts['cache_hits'] += 1
+            return cached
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.compute(key))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self.in_flight.pop(key, None))
+        else:
+            self.counts['coalesced'] += 1
+        # shield: one client disconnecting must not cancel the query for the others
+        return await asyncio.shield(task)
+
+    async def compute(self, key):
+        self.counts['computed'] += 1
+        result = await asyncio.get_running_loop().run_in_executor(self.pool, run_query, (0, key))
+        result.pop('line', None)
+        if 'error' not in result:
+            self.cache.put(key, result)
+        return result
+
+    def health(self):
+        return {'status': 'ok', 'version': self.version, 'workers': self.workers, 'cached': len(self.cache),
+                'in_flight': len(self.in_flight), **self.counts}
+
+    async def handle(self, method, path, body):
+        url = urlsplit(path)
+        route = url.path.strip('/')
+        if route == 'health' and method == 'GET':
+            return self.health()
+        if route in PARAMETERS and method == 'GET':
+            query = query_from_url(route, url.query)
+        elif route == 'query' and method == 'POST':
+            try:
+                query = json.loads(body)
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, "body must be a JSON query")
+            if not isinstance(query, dict):
+                raise RequestError(HTTPStatus.BAD_REQUEST, "body must be a JSON object")
+        elif route in PARAMETERS or route in ('health', 'query'):
+            raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported on /{route}")
+        else:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"no endpoint /{route}")
+        result = await self.query(query)
+        if 'error' in result:
+            raise RequestError(HTTPStatus.BAD_REQUEST, result['error'])
+        return result
+
+    async def serve_connection(self, reader, writer):
+        # One request per connection
+        try:
+            try:
+                method, path, body = await asyncio.wait_for(read_request(reader), READ_TIMEOUT)
+                status, payload = HTTPStatus.OK, await self.handle(method, path, body)
+            except RequestError as e:
+                status, payload = e.status, {'error': str(e)}
+            except asyncio.TimeoutError:
+                status, payload = HTTPStatus.REQUEST_TIMEOUT, {'error': "request not received in time"}
+            except Exception as e:
+                status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(e).__name__}: {e}"}
+            await write_response(writer, status, payload)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) != 3:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "malformed request line")
+    method, path, version = request_line
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ('\r\n', '\n', ''):
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise RequestError(HTTPStatus.BAD_REQUEST, "bad Content-Length")
+    if length > MAX_BODY:
+        raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "request body too large")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), path, body
+
+
+async def write_response(writer, status, payload):
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+async def serve(service, host=HOST, port=PORT, unix_path=None):
+    if unix_path:
+        server = await asyncio.start_unix_server(service.serve_connection, path=unix_path)
+        print(f"Serving catalog {service.version} on {unix_path}")
+    else:
+        server = await asyncio.start_server(service.serve_connection, host, port)
+        print(f"Serving catalog {service.version} on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve NextPage filter, recommendation and chart queries locally")
+    parser.add_argument('--csv', default='goodreads.csv', help="catalog CSV")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help="responses kept in the cache")
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL, help="seconds a cached response stays valid")
+    parser.add_argument('--text-weight', type=float, default=0.0,
+                        help="share of each recommendation score taken from description similarity")
+    args = parser.parse_args(argv)
+
+    service = QueryService(args.csv, args.workers, args.cache_size, args.cache_ttl, args.text_weight)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
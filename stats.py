@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+from scipy import stats as scipy_stats
+
+DENSITY_BINS = (120, 90)
+FIT_POINTS = 100
+
+
+def finite_pairs(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.isfinite(x) & np.isfinite(y)
+    return x[keep], y[keep]
+
+
+def linear_fit(x, y, confidence=0.95, num_points=FIT_POINTS):
+    # Ordinary least squares in closed form, with the analytic confidence band of the
+    # fitted mean (the band seaborn's regplot estimates by bootstrapping)
+    x, y = finite_pairs(x, y)
+    n = len(x)
+    if n < 3 or np.ptp(x) == 0:
+        return None
+    x_mean = x.mean()
+    y_mean = y.mean()
+    sxx = np.sum((x - x_mean) ** 2)
+    slope = np.sum((x - x_mean) * (y - y_mean)) / sxx
+    intercept = y_mean - slope * x_mean
+    residual_variance = np.sum((y - intercept - slope * x) ** 2) / (n - 2)
+
+    grid = np.linspace(x.min(), x.max(), num_points)
+    fitted = intercept + slope * grid
+    standard_error = np.sqrt(residual_variance * (1 / n + (grid - x_mean) ** 2 / sxx))
+    margin = scipy_stats.t.ppf((1 + confidence) / 2, n - 2) * standard_error
+    return grid, fitted, fitted - margin, fitted + margin
+
+
+def density_grid(x, y, bins=DENSITY_BINS):
+    # 2-D histogram of the points; drawing it costs the same however many rows there are
+    x, y = finite_pairs(x, y)
+    if len(x) == 0:
+        return None
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    return counts, x_edges, y_edges, len(x)
+
+
+NUMERIC_ATTRIBUTES = ["rating_score", "num_ratings", "current_readers", "want_to_read", "price", "num_pages"]
+HISTOGRAM_BINS = 64
+QUANTILES = (0.25, 0.5, 0.75)
+
+
+class AttributeStats:
+    # Moments, pairwise co-moments, quantiles and histograms of the numeric attributes,
+    # computed in one vectorized pass and kept as sums so appended rows can be merged in
+    def __init__(self, frame, attributes=NUMERIC_ATTRIBUTES):
+        self.attributes = [attribute for attribute in attributes if attribute in frame.columns]
+        values = self.numeric_values(frame)
+        # Sums are taken around the initial means to keep the squared terms well conditioned
+        with np.errstate(invalid='ignore'):
+            self.shift = np.nan_to_num(np.nanmean(values, axis=0)) if len(values) else np.zeros(len(self.attributes))
+        self.pair_counts = np.zeros((len(self.attributes),) * 2)
+        self.pair_sums = np.zeros_like(self.pair_counts)
+        self.pair_squares = np.zeros_like(self.pair_counts)
+        self.pair_products = np.zeros_like(self.pair_counts)
+        self.minimum = np.full(len(self.attributes), np.inf)
+        self.maximum = np.full(len(self.attributes), -np.inf)
+        self.accumulate(values)
+
+        # Quantiles are exact for the loaded rows; after an append they are read off the histograms
+        with np.errstate(invalid='ignore'):
+            self.exact_quantiles = np.nanquantile(values, QUANTILES, axis=0) if len(values) else None
+        self.histogram_edges = [np.linspace(low, high if high > low else low + 1, HISTOGRAM_BINS + 1)
+                                if np.isfinite(low) else np.linspace(0, 1, HISTOGRAM_BINS + 1)
+                                for low, high in zip(self.minimum, self.maximum)]
+        self.histogram_counts = np.zeros((len(self.attributes), HISTOGRAM_BINS), dtype=np.int64)
+        self.add_to_histograms(values)
+
+    def numeric_values(self, frame):
+        return np.column_stack([pd.to_numeric(frame[attribute], errors='coerce').to_numpy(dtype=float)
+                                for attribute in self.attributes]) if len(frame) else np.empty((0, len(self.attributes)))
+
+    def accumulate(self, values, sign=1):
+        present = np.isfinite(values)
+        shifted = np.where(present, values - self.shift, 0.0)
+        weights = present.astype(float)
+        # Entry [i, j] only counts rows where both attribute i and j are present
+        self.pair_counts += sign * (weights.T @ weights)
+        self.pair_sums += sign * (shifted.T @ weights)
+        self.pair_squares += sign * ((shifted ** 2).T @ weights)
+        self.pair_products += sign * (shifted.T @ shifted)
+        if len(values) and sign > 0:
+            with np.errstate(invalid='ignore'):
+                self.minimum = np.fmin(self.minimum, np.nanmin(values, axis=0))
+                self.maximum = np.fmax(self.maximum, np.nanmax(values, axis=0))
+
+    def add_to_histograms(self, values, sign=1):
+        for i, edges in enumerate(self.histogram_edges):
+            column = values[:, i]
+            column = np.clip(column[np.isfinite(column)], edges[0], edges[-1])  # outliers go to the end bins
+            self.histogram_counts[i] += sign * np.histogram(column, bins=edges)[0]
+
+    def append(self, frame):
+        values = self.numeric_values(frame)
+        self.accumulate(values)
+        self.add_to_histograms(values)
+        self.exact_quantiles = None
+
+    def remove(self, frame):
+        # Undoes append for rows that were replaced; min and max keep covering the removed values
+        values = self.numeric_values(frame)
+        self.accumulate(values, sign=-1)
+        self.add_to_histograms(values, sign=-1)
+        self.exact_quantiles = None
+
+    def position(self, attribute):
+        return self.attributes.index(attribute)
+
+    def count(self, attribute):
+        i = self.position(attribute)
+        return self.pair_counts[i, i]
+
+    def mean(self, attribute):
+        i = self.position(attribute)
+        return self.shift[i] + self.pair_sums[i, i] / self.pair_counts[i, i] if self.pair_counts[i, i] else np.nan
+
+    def std(self, attribute):
+        i = self.position(attribute)
+        n = self.pair_counts[i, i]
+        if n < 2:
+            return np.nan
+        return np.sqrt(max(self.pair_squares[i, i] - self.pair_sums[i, i] ** 2 / n, 0) / (n - 1))
+
+    def quantiles(self, attribute):
+        i = self.position(attribute)
+        if self.exact_quantiles is not None:
+            return self.exact_quantiles[:, i]
+        cumulative = np.concatenate([[0], np.cumsum(self.histogram_counts[i])])
+        if cumulative[-1] == 0:
+            return np.full(len(QUANTILES), np.nan)
+        return np.interp(np.asarray(QUANTILES) * cumulative[-1], cumulative, self.histogram_edges[i])
+
+    def histogram(self, attribute):
+        i = self.position(attribute)
+        return self.histogram_counts[i], self.histogram_edges[i]
+
+    def describe(self, attribute):
+        # Same rows as pandas' Series.describe()
+        i = self.position(attribute)
+        values = [self.count(attribute), self.mean(attribute), self.std(attribute), self.minimum[i],
+                  *self.quantiles(attribute), self.maximum[i]]
+        return pd.Series(values, index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'], name=attribute)
+
+    def correlation(self, attributes=None):
+        # Pearson correlation over pairwise-complete rows, like DataFrame.corr()
+        n = self.pair_counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covariance = n * self.pair_products - self.pair_sums * self.pair_sums.T
+            variance = n * self.pair_squares
+            spread = (variance - self.pair_sums ** 2) * (variance.T - self.pair_sums.T ** 2)
+            matrix = covariance / np.sqrt(spread)
+        matrix = pd.DataFrame(np.clip(matrix, -1, 1), index=self.attributes, columns=self.attributes)
+        if attributes is None:
+            return matrix
+        return matrix.loc[list(attributes), list(attributes)]
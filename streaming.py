@@ -0,0 +1,56 @@
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from engine import ChartAggregates, ChartEngine, clean_filter_frame, setup_chart_frame
+
+# Chunked reading for catalogs too large to load whole. Each chunk is cleaned the same
+# way as the in-memory pages and folded into mergeable aggregates, so memory depends on
+# the chunk size and the number of distinct formats/authors, not on the file size.
+
+CHUNK_ROWS = 100_000
+
+
+def read_chunks(path, chunksize=CHUNK_ROWS):
+    return pd.read_csv(path, chunksize=chunksize)
+
+
+def stream_chart_summary(path, chunksize=CHUNK_ROWS):
+    summary = None
+    for chunk in read_chunks(path, chunksize):
+        partial = ChartAggregates.from_frame(setup_chart_frame(chunk))
+        summary = partial if summary is None else summary.merge(partial)
+    if summary is None:
+        summary = ChartAggregates.from_frame(setup_chart_frame(pd.read_csv(path, nrows=0)))
+    return summary
+
+
+def stream_filter_chunks(path, chunksize=CHUNK_ROWS):
+    # Cleaned like FilterEngine.clean_data; a title seen in an earlier chunk is dropped
+    # so duplicates are removed across the whole file, as in memory
+    seen_titles = set()
+    for chunk in read_chunks(path, chunksize):
+        chunk, genres = clean_filter_frame(chunk)
+        rows = np.flatnonzero(~chunk['title'].isin(seen_titles).to_numpy())
+        chunk = chunk.iloc[rows].reset_index(drop=True).assign(genres=genres.take(rows).lists())
+        seen_titles.update(chunk['title'])
+        yield chunk
+
+
+def stream_chart_engine(path, chunksize=CHUNK_ROWS, version=''):
+    return ChartEngine.from_summary(stream_chart_summary(path, chunksize), version)
+
+
+if __name__ == '__main__':
+    from cli import chart_records
+
+    parser = argparse.ArgumentParser(description="Summarise a catalog CSV chunk by chunk for the Interesting Data charts")
+    parser.add_argument('--csv', default='goodreads.csv')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS, help="rows read at a time")
+    args = parser.parse_args()
+
+    engine = stream_chart_engine(args.csv, args.chunksize)
+    for chart in ChartEngine.CHARTS:
+        print(json.dumps({'chart': chart, 'results': chart_records(chart, engine.prepare(chart))}))
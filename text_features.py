@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from catalog import load_catalog, replace_array, save_array, tmp_array_path
+from recommender import title_aggregates
+
+VECTORS_DIR_NAME = 'description_vectors'
+VECTORS_FORMAT = 2  # bump when the hashing or projection changes
+HASH_FEATURES = 2 ** 18
+DIMENSIONS = 64  # dense width after the random projection
+PROJECTION_HITS = 4  # output dimensions each hashed term is added to
+CHUNK_ROWS = 20_000  # descriptions hashed per task
+SEED = 0
+
+_projections = {}
+
+
+def hash_descriptions(descriptions):
+    # Term counts in a fixed hashed space, so chunks need no shared vocabulary
+    vectorizer = HashingVectorizer(n_features=HASH_FEATURES, alternate_sign=False, norm=None,
+                                   stop_words='english', dtype=np.float32)
+    return vectorizer.transform(pd.Series(descriptions, dtype=object).fillna('').astype(str))
+
+
+def document_frequency(descriptions):
+    return np.bincount(hash_descriptions(descriptions).indices, minlength=HASH_FEATURES)
+
+
+def projection(dimensions, seed):
+    # Sparse Johnson-Lindenstrauss matrix: every hashed term lands on PROJECTION_HITS
+    # dimensions with random signs. The same seed gives the same matrix in every worker.
+    key = (dimensions, seed)
+    if key not in _projections:
+        rng = np.random.default_rng(seed)
+        hits = min(PROJECTION_HITS, dimensions)
+        columns = distinct_columns(rng, HASH_FEATURES, dimensions, hits)
+        signs = rng.choice(np.array([-1, 1], dtype=np.float32), size=(HASH_FEATURES, hits)) / np.sqrt(hits)
+        _projections[key] = sparse.csr_matrix((signs.ravel(), columns.ravel(), np.arange(0, HASH_FEATURES * hits + 1, hits)),
+                                              shape=(HASH_FEATURES, dimensions))
+    return _projections[key]
+
+
+def distinct_columns(rng, rows, dimensions, hits):
+    # hits different columns per row, redrawing only the rows that repeated one
+    columns = rng.integers(dimensions, size=(rows, hits), dtype=np.int32)
+    repeated = np.arange(rows)
+    while len(repeated):
+        ordered = np.sort(columns[repeated], axis=1)
+        repeated = repeated[(ordered[:, 1:] == ordered[:, :-1]).any(axis=1)]
+        columns[repeated] = rng.integers(dimensions, size=(len(repeated), hits), dtype=np.int32)
+    return columns
+
+
+def project_descriptions(descriptions, idf, dimensions, seed):
+    # Sublinear TF-IDF rows, L2-normalized, reduced to dense vectors
+    counts = hash_descriptions(descriptions)
+    counts.data = np.log1p(counts.data) * idf[counts.indices]
+    return np.asarray((normalize(counts) @ projection(dimensions, seed)).todense(), dtype=np.float32)
+
+
+def add_by_title(vectors, codes, chunk):
+    # Books sharing a title add up into one vector; books without a title are skipped
+    found = codes >= 0
+    titles, inverse = np.unique(codes[found], return_inverse=True)
+    totals = sparse.csr_matrix((np.ones(len(inverse), dtype=np.float32), (inverse, np.arange(len(inverse)))),
+                               shape=(len(titles), len(inverse))) @ chunk[found]
+    vectors[titles] += totals
+
+
+class DescriptionVectors:
+    # One dense vector per title, held in a memory-mapped .npy keyed to the catalog version
+    def __init__(self, meta, vectors, idf):
+        self.version = meta['version']
+        self.dimensions = meta['dimensions']
+        self.seed = meta['seed']
+        self.vectors = vectors
+        self.idf = idf
+
+    @classmethod
+    def open(cls, directory, version='', num_titles=None):
+        # None when the vectors are missing or were built for another dataset version
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+            idf = np.load(os.path.join(directory, 'idf.npy'))
+        except (OSError, ValueError):
+            return None
+        if meta.get('format') != VECTORS_FORMAT or meta.get('version') != version or (num_titles is not None and len(vectors) != num_titles):
+            return None
+        return cls(meta, vectors, idf)
+
+    @classmethod
+    def build(cls, data, titles, directory, version='', dimensions=DIMENSIONS, workers=None, seed=SEED):
+        # Two passes over the descriptions in parallel chunks: document frequencies for the
+        # IDF weights, then the projected vectors, summed per title straight into the file
+        descriptions = data['description'].to_numpy(dtype=object)
+        codes = pd.Index(titles).get_indexer(data['title'].to_numpy(dtype=object))
+        chunks = [descriptions[start:start + CHUNK_ROWS] for start in range(0, len(descriptions), CHUNK_ROWS)]
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            frequency = sum(pool.map(document_frequency, chunks), np.zeros(HASH_FEATURES, dtype=np.int64))
+            idf = (np.log((1 + len(descriptions)) / (1 + frequency)) + 1).astype(np.float32)
+            tmp_path = tmp_array_path(directory, 'vectors')
+            vectors = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(titles), dimensions))
+            offset = 0
+            for chunk in pool.map(project_descriptions, chunks, repeat(idf), repeat(dimensions), repeat(seed)):
+                add_by_title(vectors, codes[offset:offset + len(chunk)], chunk)
+                offset += len(chunk)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            vectors[start:start + CHUNK_ROWS] = normalize(vectors[start:start + CHUNK_ROWS])
+        vectors.flush()
+        del vectors
+        # Filled in place under a temporary name, then swapped in like save_array does
+        replace_array(directory, 'vectors', tmp_path)
+        save_array(directory, 'idf', idf)
+        meta = {'format': VECTORS_FORMAT, 'version': version, 'dimensions': dimensions, 'seed': seed}
+        # meta.json last, so partly written vectors are never opened
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        return cls(meta, np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r'), idf)
+
+    def transform(self, data, titles):
+        # Vectors for a few titles with the stored IDF weights, for catalog updates
+        codes = pd.Index(titles).get_indexer(data['title'].to_numpy(dtype=object))
+        vectors = np.zeros((len(titles), self.dimensions), dtype=np.float32)
+        if len(data):
+            chunk = project_descriptions(data['description'].to_numpy(dtype=object), self.idf, self.dimensions, self.seed)
+            add_by_title(vectors, codes, chunk)
+        return normalize(vectors)
+
+
+def vectors_directory(catalog):
+    return os.path.join(catalog.cache_dir, VECTORS_DIR_NAME)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the description vectors used by the recommender")
+    parser.add_argument('--csv', default='goodreads.csv')
+    parser.add_argument('--dimensions', type=int, default=DIMENSIONS)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.csv)
+    titles = title_aggregates(catalog.view(), catalog.genres)[0]
+    vectors = DescriptionVectors.build(catalog.view(), titles, vectors_directory(catalog), catalog.version,
+                                       args.dimensions, args.workers)
+    print(f"Wrote {len(vectors.vectors):,} description vectors of {vectors.dimensions} dimensions")